@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Parse-and-render cost per page of the article bodies a sync sends.
+
+Times md2zen.parse_article_html and update_urls_in_article_dict, which
+rewrites the links and renders the body, for every page of a built jupyter
+book with each available BeautifulSoup backend and checks that they produce
+the same article bodies. Build the example book first:
+
+    jupyter-book build example/mynewbook
+    python benchmarks/bench_html_parser.py example/mynewbook
+"""
+import argparse
+import logging
+import os
+import time
+
+from jupyterbook_to_zendesk.commands import md2zen as md
+from jupyterbook_to_zendesk.logging import logger
+
+PARSERS = ["html.parser", "lxml"]
+
+
+def time_page(html_file_path, article_urls, parser, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page = md.parse_article_html(html_file_path, parser)
+        article_dict = md.update_urls_in_article_dict(page, article_urls)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, article_dict["article"]["body"]
+
+
+def available_parsers():
+    parsers = []
+    for parser in PARSERS:
+        try:
+            md.bs4("<p></p>", parser)
+            parsers.append(parser)
+        except Exception:
+            print(f"{parser} is not installed, skipping it")
+    return parsers
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument(
+        "source_dir", nargs="?", default=os.path.join("example", "mynewbook")
+    )
+    arg_parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    html_files = md.gen_list_of_sections_and_html_files(args.source_dir)
+    # no article exists yet, the links get placeholder urls
+    article_urls = md.index_article_urls(html_files)
+    parsers = available_parsers()
+
+    totals = {parser: 0.0 for parser in parsers}
+    mismatches = []
+    print(f"{'page':<30}" + "".join(f"{parser:>14}" for parser in parsers))
+    for item in html_files:
+        html_file_path = item["html_file_path"]
+        bodies = set()
+        row = f"{os.path.basename(html_file_path):<30}"
+        for parser in parsers:
+            elapsed, body = time_page(
+                html_file_path, article_urls, parser, args.repeat
+            )
+            totals[parser] += elapsed
+            bodies.add(body)
+            row += f"{elapsed * 1000:>12.2f}ms"
+        if len(bodies) > 1:
+            mismatches.append(html_file_path)
+        print(row)
+
+    pages = len(html_files)
+    print(
+        f"{'mean per page':<30}"
+        + "".join(f"{totals[parser] / pages * 1000:>12.2f}ms" for parser in parsers)
+    )
+    if len(parsers) > 1:
+        speedup = totals[parsers[0]] / totals[parsers[-1]]
+        print(f"{parsers[-1]} is {speedup:.2f}x the speed of {parsers[0]}")
+        if mismatches:
+            print("Article bodies differ between parsers for:")
+            for html_file_path in mismatches:
+                print(f"  {html_file_path}")
+        else:
+            print("Article bodies are identical for every parser")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""End-to-end cost of build-jb and sync-jb-to-zendesk on synthetic books.
+
+Generates books of the requested sizes, every page with images and links to
+other pages, and runs the commands against a local fake Zendesk Help Center
+and a fake S3 endpoint (see fake_services.py). Each command runs in its own
+process and is reported with its wall time, the requests it issued, the
+bytes it sent and its peak memory (max RSS).
+
+For every book size the steps are: build-jb, a first sync into an empty
+help center and a second sync with nothing changed. build-jb needs
+jupyter-book; without it, or with --prerendered, the html pages are written
+by this script instead and only the syncs are measured.
+
+    python benchmarks/bench_sync.py --pages 100 1000 10000
+    python benchmarks/bench_sync.py --pages 1000 --sync-args="--workers 8"
+    python benchmarks/bench_sync.py --pages 1000 --image-backend zendesk
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shlex
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import botocore
+
+from fake_services import FakeS3
+from fake_services import FakeZendesk
+
+CATEGORY_NAME = "Benchmark"
+BUCKET = "jupyterbook-to-zendesk-benchmark"
+CLI = "from jupyterbook_to_zendesk.cli import main; main()"
+PAGE_HTML = """<!DOCTYPE html>
+<html><head><title>{title} &#8212; Benchmark book</title>
+<meta name="labels" content="benchmark, {name}"/></head>
+<body><div class="container-xl"><div id="main-content" class="row">
+<div><section class="tex2jax_ignore mathjax_ignore" id="{name}">
+<h1>{title}<a class="headerlink" href="#{name}">#</a></h1>
+{body}
+</section></div>
+<div class="prev-next-area"><a class="left-prev" href="{prev}.html">previous</a>
+<a class="right-next" href="{next}.html">next</a></div>
+</div></div></body></html>
+"""
+
+
+def png(seed, side):
+    # a side x side png of random pixels, so no two images compress alike
+    rng = random.Random(seed)
+    rows = b"".join(
+        b"\x00" + bytes(rng.getrandbits(8) for _ in range(side * 3))
+        for _ in range(side)
+    )
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def page_names(pages):
+    return ["intro"] + [f"page_{number:05d}" for number in range(1, pages)]
+
+
+def linked_pages(names, index):
+    # the neighbours and one page further away, like a see also
+    count = len(names)
+    return [names[(index + step) % count] for step in (-1, 1, count // 3 + 1)]
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+
+
+def make_book(book_dir, pages, pages_per_part, images_per_page, image_side, html):
+    """Write the sources of a book of pages pages, and its html when html is set"""
+    names = page_names(pages)
+    write_file(
+        os.path.join(book_dir, "_config.yml"),
+        "title: Benchmark book\nauthor: Benchmark\nlogo: images/logo.png\n"
+        'execute:\n  execute_notebooks: "off"\n',
+    )
+    toc = ["format: jb-book", "root: intro", "parts:"]
+    for start in range(1, pages, pages_per_part):
+        toc.append(f"  - caption: Part {start // pages_per_part + 1}")
+        toc.append("    chapters:")
+        for name in names[start : start + pages_per_part]:
+            toc.append(f"      - file: {name}")
+    write_file(os.path.join(book_dir, "_toc.yml"), "\n".join(toc) + "\n")
+
+    logo = png(0, image_side)
+    write_file(os.path.join(book_dir, "images", "logo.png"), logo)
+    html_images_dir = os.path.join(book_dir, "_build", "html", "_images")
+    if html:
+        write_file(os.path.join(html_images_dir, "logo.png"), logo)
+
+    for index, name in enumerate(names):
+        title = name.replace("_", " ").capitalize()
+        images = [f"{name}_{number}.png" for number in range(images_per_page)]
+        links = linked_pages(names, index)
+        markdown = [f"# {title}", "", f"Synthetic page {index} of the benchmark."]
+        markdown.append("![logo](images/logo.png)")
+        body = [f"<p>Synthetic page {index} of the benchmark.</p>"]
+        body.append('<img alt="logo" src="_images/logo.png"/>')
+        for image in images:
+            data = png(image, image_side)
+            write_file(os.path.join(book_dir, "images", image), data)
+            markdown.append(f"![figure](images/{image})")
+            body.append(f'<img alt="figure" src="_images/{image}"/>')
+            if html:
+                write_file(os.path.join(html_images_dir, image), data)
+        for link in links:
+            markdown.append(f"See [{link}]({link}.md).")
+            body.append(
+                f'<p>See <a class="reference internal" href="{link}.html">{link}</a>'
+                '. Or <a class="reference external" href="https://example.com/">'
+                "outside</a>.</p>"
+            )
+        markdown.append("")
+        markdown.append("Lorem ipsum dolor sit amet. " * 40)
+        body.append("<p>" + "Lorem ipsum dolor sit amet. " * 40 + "</p>")
+        write_file(os.path.join(book_dir, name + ".md"), "\n".join(markdown) + "\n")
+        if html:
+            write_file(
+                os.path.join(book_dir, "_build", "html", name + ".html"),
+                PAGE_HTML.format(
+                    title=title,
+                    name=name,
+                    body="\n".join(body),
+                    prev=links[0],
+                    next=links[1],
+                ),
+            )
+
+
+def write_config(path, zendesk, image_backend):
+    write_file(
+        path,
+        "[DEFAULT]\n"
+        "username = benchmark@example.com/token\n"
+        "token = benchmark\n"
+        f"url = {zendesk.url}\n"
+        f"zendesk_category_name = {CATEGORY_NAME}\n"
+        f"image_backend = {image_backend}\n"
+        f"aws_s3_bucket = {BUCKET}\n"
+        "aws_access_key = benchmark\n"
+        "aws_secret = benchmark\n",
+    )
+
+
+def command_env(work_dir, s3_url):
+    # boto3 reads the endpoint from AWS_ENDPOINT_URL_S3 (botocore 1.31 and up),
+    # the fake bucket is only reachable path style
+    aws_config = os.path.join(work_dir, "aws_config")
+    write_file(aws_config, "[default]\ns3 =\n    addressing_style = path\n")
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env.update(
+        {
+            "AWS_ENDPOINT_URL_S3": s3_url,
+            "AWS_CONFIG_FILE": aws_config,
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_REQUEST_CHECKSUM_CALCULATION": "when_required",
+            "AWS_RESPONSE_CHECKSUM_VALIDATION": "when_required",
+            "NO_PROXY": "127.0.0.1",
+            "PYTHONPATH": os.pathsep.join(
+                filter(None, [repo_dir, os.environ.get("PYTHONPATH")])
+            ),
+        }
+    )
+    return env
+
+
+def max_rss_bytes(rusage):
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    return rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+
+
+def run_command(step, command, args, book_dir, config_file, env, services, log_file):
+    for service in services.values():
+        service.counter.reset()
+    argv = [sys.executable, "-c", CLI, "-s", book_dir, "-d", book_dir]
+    argv += ["-c", config_file, command] + args
+    with open(log_file, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            argv, stdout=log, stderr=subprocess.STDOUT, cwd=book_dir, env=env
+        )
+        # wait4 gives the peak memory of this process alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    result = {
+        "step": step,
+        "exit_code": process.returncode,
+        "wall_seconds": wall,
+        "peak_rss_bytes": max_rss_bytes(rusage),
+        "log": log_file,
+    }
+    for name, service in services.items():
+        result[f"{name}_requests"] = dict(service.counter.requests)
+        result[f"{name}_bytes"] = service.counter.bytes_received
+    return result
+
+
+def bench_book(pages, args):
+    book_dir = os.path.join(args.work_dir, f"book_{pages}")
+    shutil.rmtree(book_dir, ignore_errors=True)
+    build = not args.prerendered and importlib.util.find_spec("jupyter_book")
+    started = time.perf_counter()
+    make_book(
+        book_dir,
+        pages,
+        args.pages_per_part,
+        args.images_per_page,
+        args.image_side,
+        html=not build,
+    )
+    seconds = time.perf_counter() - started
+    print(f"\n{pages} pages written to {book_dir} in {seconds:.1f}s")
+    if not build:
+        print("build-jb skipped, the html pages were generated instead")
+
+    results = []
+    with FakeZendesk(CATEGORY_NAME) as zendesk, FakeS3() as s3:
+        services = {"zendesk": zendesk, "s3": s3}
+        config_file = os.path.join(book_dir, "config.cfg")
+        write_config(config_file, zendesk, args.image_backend)
+        env = command_env(args.work_dir, s3.url)
+        steps = [("sync (first)", "sync-jb-to-zendesk", args.sync_args)]
+        steps.append(("sync (unchanged)", "sync-jb-to-zendesk", args.sync_args))
+        if build:
+            steps.insert(0, ("build-jb", "build-jb", args.build_args))
+        for step, command, command_args in steps:
+            log_file = os.path.join(
+                args.work_dir, f"{pages}_{step.split()[0]}_{len(results)}.log"
+            )
+            result = run_command(
+                step,
+                command,
+                shlex.split(command_args),
+                book_dir,
+                config_file,
+                env,
+                services,
+                log_file,
+            )
+            result["pages"] = pages
+            results.append(result)
+            print_result(result)
+            if result["exit_code"] != 0:
+                print(f"{command} failed, see {log_file}")
+                break
+    return results
+
+
+def print_header():
+    print(
+        f"{'pages':>6} {'step':<17}{'wall':>9}{'zendesk req':>13}{'s3 req':>8}"
+        f"{'bytes sent':>13}{'peak rss':>11}"
+    )
+
+
+def print_result(result):
+    zendesk_requests = sum(result["zendesk_requests"].values())
+    s3_requests = sum(result["s3_requests"].values())
+    sent = result["zendesk_bytes"] + result["s3_bytes"]
+    print(
+        f"{result['pages']:>6} {result['step']:<17}"
+        f"{result['wall_seconds']:>8.2f}s{zendesk_requests:>13}{s3_requests:>8}"
+        f"{sent / 1e6:>11.2f}MB{result['peak_rss_bytes'] / 1e6:>9.1f}MB"
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000])
+    arg_parser.add_argument("--pages-per-part", type=int, default=100)
+    arg_parser.add_argument("--images-per-page", type=int, default=1)
+    arg_parser.add_argument(
+        "--image-side", type=int, default=48, help="width and height of the images"
+    )
+    arg_parser.add_argument(
+        "--image-backend",
+        default="s3",
+        choices=["s3", "zendesk"],
+        help="upload the images to the fake S3 or as fake Zendesk attachments",
+    )
+    arg_parser.add_argument("--prerendered", action="store_true")
+    arg_parser.add_argument("--build-args", default="", help="extra build-jb options")
+    arg_parser.add_argument("--sync-args", default="", help="extra sync options")
+    arg_parser.add_argument("--work-dir", default=None)
+    arg_parser.add_argument("--json", default=None, help="also write the results here")
+    args = arg_parser.parse_args()
+
+    botocore_version = tuple(int(part) for part in botocore.__version__.split(".")[:2])
+    if botocore_version < (1, 31):
+        sys.exit("botocore 1.31 or later is needed to point boto3 at the fake S3")
+
+    args.work_dir = os.path.abspath(
+        args.work_dir or tempfile.mkdtemp(prefix="bench_sync_")
+    )
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    print_header()
+    results = []
+    for pages in args.pages:
+        results.extend(bench_book(pages, args))
+
+    print()
+    print_header()
+    for result in results:
+        print_result(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
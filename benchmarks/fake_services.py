@@ -0,0 +1,369 @@
+"""Local stand-ins for Zendesk Help Center and S3, used by bench_sync.py.
+
+Both are plain http.server servers running on a background thread. They keep
+what they are sent in memory and count the requests and bytes they receive,
+so a benchmark can measure what a command sends over the wire.
+"""
+import hashlib
+import itertools
+import json
+import re
+import threading
+from datetime import datetime
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+LOCALE = r"(?:/[a-z]{2}(?:-[a-z]{2})?)?"
+HC = r"/api/v2/help_center" + LOCALE
+S3_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+class RequestCounter:
+    """Requests and bytes received by a fake service, by method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.bytes_received = 0
+
+    def record(self, method, size):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            self.bytes_received += size
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, without this every
+    # response waits on a delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        size = len(self.raw_requestline) + len(bytes(self.headers)) + len(body)
+        self.server.counter.record(self.command, size)
+        return body
+
+    def respond(
+        self, status, body=b"", content_type="application/json", headers=None
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_json(self, status, data):
+        self.respond(status, json.dumps(data).encode("utf-8"))
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_PUT(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_DELETE(self):
+        self.handle_request()
+
+    def do_HEAD(self):
+        self.handle_request()
+
+
+class FakeService:
+    handler_class = FakeServiceHandler
+
+    def __init__(self):
+        self.counter = RequestCounter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class)
+        self.server.daemon_threads = True
+        self.server.service = self
+        self.server.counter = self.counter
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def paginate(records, key, url, query):
+    # cursor pages when page[size] is asked for, offset pages otherwise
+    if "page[size]" in query:
+        size = int(query["page[size]"])
+        start = int(query.get("page[after]") or 0)
+        chunk = records[start : start + size]
+        has_more = start + size < len(records)
+        next_query = dict(query, **{"page[after]": str(start + size)})
+        return {
+            key: chunk,
+            "meta": {"has_more": has_more, "after_cursor": str(start + size)},
+            "links": {"next": f"{url}?{urlencode(next_query)}" if has_more else None},
+        }
+    per_page = int(query.get("per_page") or 30)
+    page = int(query.get("page") or 1)
+    chunk = records[(page - 1) * per_page : page * per_page]
+    page_count = max(-(-len(records) // per_page), 1)
+    next_query = dict(query, page=str(page + 1), per_page=str(per_page))
+    return {
+        key: chunk,
+        "page": page,
+        "per_page": per_page,
+        "page_count": page_count,
+        "count": len(records),
+        "next_page": f"{url}?{urlencode(next_query)}" if page < page_count else None,
+    }
+
+
+class ZendeskHandler(FakeServiceHandler):
+    routes = [
+        ("GET", r"/api/v2/users/me\.json", "get_me"),
+        ("GET", HC + r"/categories\.json", "list_categories"),
+        ("POST", HC + r"/categories\.json", "create_category"),
+        ("GET", HC + r"/sections\.json", "list_sections"),
+        ("GET", HC + r"/categories/(\d+)/sections(?:\.json)?", "list_sections"),
+        ("POST", HC + r"/categories/(\d+)/sections(?:\.json)?", "create_section"),
+        ("GET", HC + r"/categories/(\d+)/articles\.json", "list_articles"),
+        ("POST", HC + r"/sections/(\d+)/articles(?:\.json)?", "create_article"),
+        ("PUT", HC + r"/articles/(\d+)\.json", "update_article"),
+        ("PUT", HC + r"/articles/(\d+)/translations/([\w-]+)\.json", "translate"),
+        ("DELETE", HC + r"/articles/(\d+)\.json", "archive_article"),
+        ("POST", HC + r"/articles/attachments\.json", "create_attachment"),
+        ("POST", HC + r"/articles/(\d+)/bulk_attachments\.json", "associate"),
+    ]
+
+    def handle_request(self):
+        body = self.read_body()
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        for method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, parts.path)
+            if method == self.command and match:
+                # attachments are multipart forms, only their size matters here
+                is_json = self.headers.get("Content-Type") == "application/json"
+                data = json.loads(body) if body and is_json else body
+                with self.server.service.lock:
+                    status, response = getattr(self.server.service, name)(
+                        self.server.service.url + parts.path,
+                        query,
+                        data,
+                        *match.groups(),
+                    )
+                if response is None:
+                    self.respond(status)
+                else:
+                    self.respond_json(status, response)
+                return
+        self.respond_json(404, {"error": "RecordNotFound"})
+
+
+class FakeZendesk(FakeService):
+    """Help Center endpoints the sync uses, backed by in-memory dicts"""
+
+    handler_class = ZendeskHandler
+
+    def __init__(self, category_name):
+        super().__init__()
+        self.ids = itertools.count(1000)
+        self.categories = {}
+        self.sections = {}
+        self.articles = {}
+        self.attachments = {}
+        category_id = next(self.ids)
+        self.categories[category_id] = {"id": category_id, "name": category_name}
+
+    def get_me(self, url, query, data):
+        return 200, {"user": {"id": 1, "role": "admin"}}
+
+    def list_categories(self, url, query, data):
+        return 200, paginate(list(self.categories.values()), "categories", url, query)
+
+    def create_category(self, url, query, data):
+        category_id = next(self.ids)
+        category = dict(data["category"], id=category_id)
+        self.categories[category_id] = category
+        return 201, {"category": category}
+
+    def list_sections(self, url, query, data, category_id=None):
+        sections = [
+            section
+            for section in self.sections.values()
+            if category_id is None or section["category_id"] == int(category_id)
+        ]
+        return 200, paginate(sections, "sections", url, query)
+
+    def create_section(self, url, query, data, category_id):
+        section_id = next(self.ids)
+        section = dict(data["section"], id=section_id, category_id=int(category_id))
+        self.sections[section_id] = section
+        return 201, {"section": section}
+
+    def list_articles(self, url, query, data, category_id):
+        articles = [
+            article
+            for article in self.articles.values()
+            if self.sections[article["section_id"]]["category_id"] == int(category_id)
+        ]
+        return 200, paginate(articles, "articles", url, query)
+
+    def touch(self, article):
+        now = datetime.now(timezone.utc)
+        article["updated_at"] = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def create_article(self, url, query, data, section_id):
+        article_id = next(self.ids)
+        article = dict(
+            data["article"],
+            id=article_id,
+            section_id=int(section_id),
+            html_url=f"{self.url}/hc/en-us/articles/{article_id}",
+        )
+        self.touch(article)
+        self.articles[article_id] = article
+        return 201, {"article": article}
+
+    def update_article(self, url, query, data, article_id):
+        article = self.articles.get(int(article_id))
+        if article is None:
+            return 404, {"error": "RecordNotFound"}
+        article.update(data.get("article", data))
+        self.touch(article)
+        return 200, {"article": article}
+
+    def translate(self, url, query, data, article_id, locale):
+        article = self.articles.get(int(article_id))
+        if article is None:
+            return 404, {"error": "RecordNotFound"}
+        translation = dict(data["translation"], locale=locale, source_id=article["id"])
+        for key in ["title", "body", "draft"]:
+            if key in translation:
+                article[key] = translation[key]
+        self.touch(article)
+        return 200, {"translation": translation}
+
+    def create_attachment(self, url, query, data):
+        attachment_id = next(self.ids)
+        attachment = {
+            "id": attachment_id,
+            "content_url": f"{self.url}/hc/article_attachments/{attachment_id}",
+            "size": len(data),
+            "inline": True,
+        }
+        self.attachments[attachment_id] = attachment
+        return 201, {"article_attachment": attachment}
+
+    def associate(self, url, query, data, article_id):
+        if int(article_id) not in self.articles:
+            return 404, {"error": "RecordNotFound"}
+        attachments = []
+        for attachment_id in data["attachment_ids"]:
+            attachment = self.attachments[attachment_id]
+            attachment["article_id"] = int(article_id)
+            attachments.append(attachment)
+        return 200, {"article_attachments": attachments}
+
+    def archive_article(self, url, query, data, article_id):
+        if self.articles.pop(int(article_id), None) is None:
+            return 404, None
+        return 204, None
+
+
+class S3Handler(FakeServiceHandler):
+    def handle_request(self):
+        body = self.read_body()
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        bucket, _, key = parts.path.lstrip("/").partition("/")
+        service = self.server.service
+        with service.lock:
+            objects = service.buckets.setdefault(bucket, {})
+            if self.command == "PUT" and key:
+                objects[key] = {
+                    "size": len(body),
+                    "etag": hashlib.md5(body).hexdigest(),
+                    "last_modified": datetime.now(timezone.utc),
+                }
+                etag = {"ETag": f'"{objects[key]["etag"]}"'}
+                self.respond(200, content_type="application/xml", headers=etag)
+            elif self.command in ("GET", "HEAD") and not key:
+                listing = service.list_objects(objects, query)
+                self.respond(200, listing, "application/xml")
+            elif self.command == "HEAD" and key in objects:
+                etag = {"ETag": f'"{objects[key]["etag"]}"'}
+                self.respond(200, content_type="binary/octet-stream", headers=etag)
+            else:
+                self.respond(404, content_type="application/xml")
+
+
+class FakeS3(FakeService):
+    """PutObject, HeadObject and ListObjectsV2 of a path style S3 endpoint"""
+
+    handler_class = S3Handler
+    max_keys = 1000
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = {}
+
+    def list_objects(self, objects, query):
+        prefix = query.get("prefix", "")
+        keys = sorted(key for key in objects if key.startswith(prefix))
+        start_after = query.get("continuation-token") or query.get("start-after")
+        if start_after:
+            keys = [key for key in keys if key > start_after]
+        page, truncated = keys[: self.max_keys], len(keys) > self.max_keys
+        contents = "".join(
+            "<Contents>"
+            f"<Key>{escape(key)}</Key>"
+            f"<LastModified>{objects[key]['last_modified']:{S3_TIME_FORMAT}}"
+            "</LastModified>"
+            f"<ETag>&quot;{objects[key]['etag']}&quot;</ETag>"
+            f"<Size>{objects[key]['size']}</Size>"
+            "<StorageClass>STANDARD</StorageClass>"
+            "</Contents>"
+            for key in page
+        )
+        next_token = (
+            f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>"
+            if truncated
+            else ""
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(page)}</KeyCount>"
+            f"<MaxKeys>{self.max_keys}</MaxKeys>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            f"{contents}{next_token}"
+            "</ListBucketResult>"
+        ).encode("utf-8")
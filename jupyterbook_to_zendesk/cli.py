@@ -32,9 +32,53 @@ def cli(ctx, debug, source_dir, destination_dir, config_file):
 
 
 @cli.command("build-jb")
+@click.option(
+    "--incremental/--full",
+    default=False,
+    help="Skip the build when no source changed since the last one.",
+)
+@click.option(
+    "--in-process/--subprocess",
+    default=False,
+    help="Build through the jupyter-book python API and report phase timings.",
+)
+@click.option(
+    "--execute-notebooks",
+    default=None,
+    type=click.Choice(["auto", "force", "cache", "off"]),
+    help="When to execute notebooks, overrides execute_notebooks in _config.yml.",
+)
+@click.option(
+    "--execution-cache",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="jupyter-cache folder for --execute-notebooks cache, reusable across builds.",
+)
+@click.option(
+    "--execution-timeout",
+    default=None,
+    type=click.IntRange(min=-1),
+    help="Seconds a notebook may take to execute, -1 for no limit.",
+)
 @click.pass_context
-def command_build(ctx):
+def command_build(
+    ctx,
+    incremental,
+    in_process,
+    execute_notebooks,
+    execution_cache,
+    execution_timeout,
+):
     """Console script for jupyterbook_to_zendesk."""
+    if execution_cache and execute_notebooks not in (None, "cache"):
+        raise click.BadOptionUsage(
+            "execution_cache", "--execution-cache needs --execute-notebooks cache"
+        )
+    ctx.obj["incremental"] = incremental
+    ctx.obj["in_process"] = in_process
+    ctx.obj["execute_notebooks"] = execute_notebooks
+    ctx.obj["execution_cache"] = execution_cache
+    ctx.obj["execution_timeout"] = execution_timeout
     logger.info("Building the jupyterbook")
     build_jupyterbook.build(ctx)
 
@@ -43,11 +87,62 @@ def command_build(ctx):
 @click.option("--archive/--no-archive", default=False)
 @click.option("--draft/--no-draft", default=True)
 @click.option("--public/--no-public", default=True)
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of articles to send to ZenDesk in parallel.",
+)
+@click.option(
+    "--image-workers",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of images to upload in parallel.",
+)
+@click.option(
+    "--skip-unchanged-images/--upload-all-images",
+    default=True,
+    help="Only upload images that are missing or different on S3 or Zendesk.",
+)
+@click.option(
+    "--content-addressed-images/--named-images",
+    default=False,
+    help="Store images on S3 under the sha256 of their content, cacheable forever.",
+)
+@click.option(
+    "--incremental/--all-pages",
+    default=False,
+    help="Only sync the pages whose sources changed since they were last synced.",
+)
+@click.option(
+    "--html-parser",
+    default=None,
+    type=click.Choice(["lxml", "html.parser"]),
+    help="BeautifulSoup parser for the built pages, lxml when it is installed.",
+)
 @click.pass_context
-def command_sync(ctx, archive, draft, public):
+def command_sync(
+    ctx,
+    archive,
+    draft,
+    public,
+    workers,
+    image_workers,
+    skip_unchanged_images,
+    content_addressed_images,
+    incremental,
+    html_parser,
+):
     ctx.obj["archive_flag"] = archive
     ctx.obj["draft"] = draft
     ctx.obj["public"] = public
+    ctx.obj["workers"] = workers
+    ctx.obj["image_workers"] = image_workers
+    ctx.obj["skip_unchanged_images"] = skip_unchanged_images
+    ctx.obj["content_addressed_images"] = content_addressed_images
+    ctx.obj["incremental"] = incremental
+    ctx.obj["html_parser"] = html_parser
     logger.info("Syncing the Jupyterbook to ZenDesk")
     sync_to_zendesk.sync(ctx)
 
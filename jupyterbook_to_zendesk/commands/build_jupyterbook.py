@@ -18,25 +18,43 @@ from jupyterbook_to_zendesk.logging import logger
 def build(ctx):
     """Build the jupyterbook"""
 
-    App = md.Config(ctx.obj["config_file"])
+    App = md.load_config(ctx.obj["config_file"])
 
-    hc = md.HelpCenter(App.get("url"), App.get("username"), App.get("token"))
+    hc = md.get_help_center(App)
     s3 = boto3.client(
         "s3",
         aws_access_key_id=App.get("aws_access_key"),
         aws_secret_access_key=App.get("aws_secret"),
     )
 
+    # the category and section ids of the last sync are kept in zendesk.json
+    zendesk_file_path = os.path.join(ctx.obj["destination_dir"], md.ZENDESK_FILE)
+    zendesk_state = md.read_zendesk_json(zendesk_file_path)
     zendesk_category_name = App.get("zendesk_category_name")
-    zendesk_category_id = md.check_category_on_zendesk(hc, zendesk_category_name)
+    zendesk_category_id = md.manifest_category_id(zendesk_state, zendesk_category_name)
+    if zendesk_category_id is None:
+        zendesk_category_id = md.check_category_on_zendesk(hc, zendesk_category_name)
 
     # find html files to send over
     html_files_list = md.gen_list_of_sections_and_html_files(ctx.obj["source_dir"])
 
     # generate jupyter book
-    md.gen_jupyter_book(ctx.obj["source_dir"])
+    md.gen_jupyter_book(
+        ctx.obj["source_dir"],
+        incremental=ctx.obj.get("incremental", False),
+        in_process=ctx.obj.get("in_process", False),
+        jobs=md.parse_build_jobs(md.get_config_option(App, "jupyter_book_jobs")),
+        execution=md.execution_config(
+            execute_notebooks=ctx.obj.get("execute_notebooks"),
+            cache=ctx.obj.get("execution_cache"),
+            timeout=ctx.obj.get("execution_timeout"),
+        ),
+    )
     html_files_for_zendesk = md.handle_sections_on_zendesk(
-        hc, html_files_list, zendesk_category_id
+        hc,
+        html_files_list,
+        zendesk_category_id,
+        known_sections=md.manifest_sections(zendesk_state, zendesk_category_id),
     )
     # logging.info(f"html files to upload to Zendesk: \n {html_files_for_zendesk}")
     return 0
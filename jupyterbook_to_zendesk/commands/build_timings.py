@@ -0,0 +1,100 @@
+"""Sphinx extension timing the phases of an in-process jupyter-book build."""
+import time
+
+# seconds per phase of the last build, see md2zen.build_jupyter_book_in_process
+timings = {}
+_marks = {}
+_docnames = []
+
+
+def reset():
+    timings.clear()
+    _marks.clear()
+    del _docnames[:]
+
+
+def myst_nb_major_version(app):
+    extension = getattr(app, "extensions", {}).get("myst_nb")
+    try:
+        return int(str(getattr(extension, "version", None) or "0").split(".")[0])
+    except ValueError:
+        return 0
+
+
+def notebook_execution_seconds(app, docnames, started_at):
+    """Runtimes myst-nb reports for the notebooks it executed while reading.
+
+    None when the installed myst-nb keeps no execution data we know of.
+    """
+    env = app.env
+    seconds = 0.0
+    if hasattr(env, "nb_execution_data"):
+        # myst-nb 0.13, notebooks run through jupyter-cache are timed in
+        # env-get-outdated instead
+        for docname in docnames:
+            data = env.nb_execution_data.get(docname) or {}
+            if data.get("method") != "cache":
+                seconds += data.get("runtime") or 0.0
+        return seconds
+    if hasattr(env, "nb_metadata") or myst_nb_major_version(app) >= 1:
+        # myst-nb 1.x executes while reading in every mode, a cache hit
+        # carries the runtime and time of the run that filled the cache
+        metadata = getattr(env, "nb_metadata", None) or {}
+        for docname in docnames:
+            data = (metadata.get(docname) or {}).get("exec_data") or {}
+            if (data.get("mtime") or 0.0) >= started_at:
+                seconds += data.get("runtime") or 0.0
+        return seconds
+    return None
+
+
+def on_env_get_outdated_start(app, env, added, changed, removed):
+    _marks["read"] = time.perf_counter()
+    _marks["started_at"] = time.time()
+    return []
+
+
+def on_env_get_outdated_end(app, env, added, changed, removed):
+    # with execute_notebooks: cache myst-nb runs the outdated notebooks
+    # in its own env-get-outdated handler, between these two
+    _marks["cache_executed"] = time.perf_counter()
+    return []
+
+
+def on_env_before_read_docs(app, env, docnames):
+    if "read" not in _marks:
+        _marks["read"] = time.perf_counter()
+        _marks["started_at"] = time.time()
+    _docnames.extend(docnames)
+
+
+def on_env_updated(app, env):
+    _marks["write"] = time.perf_counter()
+
+
+def on_build_finished(app, exception):
+    finished = time.perf_counter()
+    read = _marks.get("read", finished)
+    write = _marks.get("write", read)
+    execute = notebook_execution_seconds(
+        app, _docnames, _marks.get("started_at", 0.0)
+    )
+    if execute is not None:
+        execute += _marks.get("cache_executed", read) - read
+    timings.update(
+        {
+            "read": max(write - read - (execute or 0.0), 0.0),
+            "execute": execute,
+            "write": finished - write,
+            "documents": len(_docnames),
+        }
+    )
+
+
+def setup(app):
+    app.connect("env-get-outdated", on_env_get_outdated_start, priority=100)
+    app.connect("env-get-outdated", on_env_get_outdated_end, priority=900)
+    app.connect("env-before-read-docs", on_env_before_read_docs)
+    app.connect("env-updated", on_env_updated)
+    app.connect("build-finished", on_build_finished)
+    return {"parallel_read_safe": True, "parallel_write_safe": True}
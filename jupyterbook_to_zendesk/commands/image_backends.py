@@ -0,0 +1,223 @@
+"""Where the images of a book are uploaded, image_backend in config.cfg.
+
+md2zen.upload_book_images groups the images of a book by digest and hands
+every distinct image to a backend, from a pool of worker threads:
+
+    forget_missing_articles(ids)      the article ids in zendesk.json, before
+    prepare(images, skip_unchanged)   once, before the uploads
+    is_uploaded(image)                already there, its upload is skipped
+    upload(image)                     on a worker thread, False if it failed
+    url(image)                        what the img tags of the image point to
+    save()                            once the uploads are done
+    associate(html_files, workers)    once the articles of the book exist
+"""
+import json
+import mimetypes
+import os
+import threading
+
+import boto3
+
+import jupyterbook_to_zendesk.commands.md2zen as md
+from jupyterbook_to_zendesk.logging import logger
+
+IMAGE_BACKENDS = ["s3", "zendesk"]
+# digest of an image to the zendesk attachment it was uploaded as
+ZENDESK_ATTACHMENTS_FILE = "zendesk_attachments.json"
+# zendesk associates at most 20 attachments to an article per request
+ZENDESK_ATTACHMENTS_PER_REQUEST = 20
+
+
+class S3ImageBackend:
+    """Images as public objects of an S3 bucket, the default"""
+
+    name = "s3"
+    label = "S3"
+
+    def __init__(self, s3, bucket, content_addressed=False):
+        self.s3 = s3
+        self.bucket = bucket
+        self.content_addressed = content_addressed
+        self.cache_control = None
+        if content_addressed:
+            self.cache_control = md.S3_IMMUTABLE_CACHE_CONTROL
+        self.remote_objects = {}
+
+    def forget_missing_articles(self, article_ids):
+        pass
+
+    def prepare(self, images, skip_unchanged=False):
+        self.remote_objects = {}
+        if skip_unchanged and images:
+            try:
+                self.remote_objects = md.find_s3_objects(
+                    self.s3, self.bucket, [image["s3_file_key"] for image in images]
+                )
+            except Exception as e:
+                logger.warning(f"Unable to list s3://{self.bucket}, uploading all. {e}")
+
+    def is_uploaded(self, image):
+        return md.s3_object_matches(
+            self.remote_objects, image["img_file_path"], image["s3_file_key"]
+        )
+
+    def upload(self, image):
+        return md.upload_to_aws_s3(
+            self.s3,
+            image["img_file_path"],
+            self.bucket,
+            image["s3_file_key"],
+            cache_control=self.cache_control,
+        )
+
+    def url(self, image):
+        return md.AWS_URL_PREFIX + self.bucket + "/" + image["s3_file_key"]
+
+    def save(self):
+        pass
+
+    def associate(self, html_files_for_zendesk, workers=1):
+        pass
+
+
+class ZendeskAttachmentImageBackend:
+    """Images as inline article attachments of the help center itself.
+
+    The images go up as unassociated attachments, before the articles using
+    them exist, and are associated to the first article using them once it
+    does. An attachment belongs to a single article, the other articles link
+    to its content_url all the same. The attachments are kept by digest in
+    zendesk_attachments.json, the next sync only uploads the new images.
+
+    An attachment goes away with its article, and zendesk purges the ones
+    never associated, so forget_missing_articles drops those entries and
+    their images are uploaded again.
+    """
+
+    name = "zendesk"
+    label = "Zendesk"
+    content_addressed = False
+
+    def __init__(self, hc, attachments_file_path):
+        self.hc = hc
+        self.attachments_file_path = attachments_file_path
+        self.attachments = read_attachments(attachments_file_path)
+        self.images = []
+        self._lock = threading.Lock()
+
+    def forget_missing_articles(self, article_ids):
+        # article_ids are the articles of zendesk.json, an attachment of any
+        # other article, or of none, may have been deleted along with it
+        kept = {
+            digest: attachment
+            for digest, attachment in self.attachments.items()
+            if attachment.get("article_id") in article_ids
+        }
+        if len(kept) < len(self.attachments):
+            logger.info(
+                f"Uploading {len(self.attachments) - len(kept)} image attachments "
+                "again, their articles are no longer synced"
+            )
+        self.attachments = kept
+
+    def prepare(self, images, skip_unchanged=False):
+        self.images = images
+        if not skip_unchanged:
+            self.attachments = {}
+
+    def is_uploaded(self, image):
+        return image["digest"] in self.attachments
+
+    def upload(self, image):
+        img_file_path = image["img_file_path"]
+        file_name = os.path.basename(img_file_path)
+        content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        try:
+            with open(img_file_path, "rb") as f:
+                content = f.read()
+            response_json = self.hc.create_unassociated_attachment(
+                {"inline": "true"}, files={"file": (file_name, content, content_type)}
+            )
+            attachment = response_json["article_attachment"]
+        except Exception as e:
+            logger.error(f"{img_file_path}: Some Error occured uploading. {e}")
+            return False
+        logger.info(f"{img_file_path}: Upload Successful")
+        with self._lock:
+            self.attachments[image["digest"]] = {
+                "id": attachment["id"],
+                "content_url": attachment["content_url"],
+            }
+        return True
+
+    def url(self, image):
+        attachment = self.attachments.get(image["digest"])
+        return attachment["content_url"] if attachment else None
+
+    def save(self):
+        md.write_json_file(self.attachments_file_path, self.attachments)
+
+    def associate(self, html_files_for_zendesk, workers=1):
+        article_ids = {
+            f["html_file_path"]: f["article_id"]
+            for f in html_files_for_zendesk
+            if "article_id" in f
+        }
+        attachments_by_article = {}
+        for image in self.images:
+            attachment = self.attachments.get(image["digest"])
+            if attachment is None or "article_id" in attachment:
+                continue
+            for html_file_path in image["html_file_paths"]:
+                if html_file_path in article_ids:
+                    article_id = article_ids[html_file_path]
+                    attachments_by_article.setdefault(article_id, []).append(
+                        attachment
+                    )
+                    break
+
+        def associate_article(item):
+            article_id, attachments = item
+            for start in range(0, len(attachments), ZENDESK_ATTACHMENTS_PER_REQUEST):
+                chunk = attachments[start : start + ZENDESK_ATTACHMENTS_PER_REQUEST]
+                data = {"attachment_ids": [attachment["id"] for attachment in chunk]}
+                self.hc.associate_article_attachments(article_id, json.dumps(data))
+                with self._lock:
+                    for attachment in chunk:
+                        attachment["article_id"] = article_id
+
+        try:
+            md.map_with_workers(
+                associate_article, list(attachments_by_article.items()), workers
+            )
+        except Exception as e:
+            # the next sync uploads what is left unassociated again
+            logger.warning(f"Unable to associate the image attachments. {e}")
+        self.save()
+
+
+def read_attachments(attachments_file_path):
+    if not os.path.exists(attachments_file_path):
+        return {}
+    with open(attachments_file_path) as f:
+        return json.load(f)
+
+
+def get_image_backend(App, hc, destination_dir, content_addressed=False):
+    image_backend = md.get_config_option(App, "image_backend", "s3")
+    if image_backend == "zendesk":
+        return ZendeskAttachmentImageBackend(
+            hc, os.path.join(destination_dir, ZENDESK_ATTACHMENTS_FILE)
+        )
+    if image_backend != "s3":
+        raise ValueError(
+            f"Unknown image_backend {image_backend}, expected one of "
+            + ", ".join(IMAGE_BACKENDS)
+        )
+    # TODO add check that s3 bucket exists
+    s3 = boto3.client(
+        "s3",
+        aws_access_key_id=App.get("aws_access_key"),
+        aws_secret_access_key=App.get("aws_secret"),
+    )
+    return S3ImageBackend(s3, App.get("aws_s3_bucket"), content_addressed)
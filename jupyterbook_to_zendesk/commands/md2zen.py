@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
+import hashlib
 import json
 import logging
 import os
 import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from datetime import datetime
 from glob import glob
 from pprint import pprint
@@ -11,13 +17,20 @@ from pprint import pprint
 from copy import deepcopy
 import boto3
 import yaml
+from botocore.exceptions import ClientError
 from bs4 import BeautifulSoup as bs4
 from prettyprinter import cpprint
 
-from jupyterbook_to_zendesk.config import Config
 from jupyterbook_to_zendesk.logging import logger
 from jupyterbook_to_zendesk.zendeskhc.HelpCenter import HelpCenter
 
+try:  # lxml is a lot faster, fall back to the parser that ships with python
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 
 ERROR_CODE = 1
 OK_CODE = 0
@@ -27,6 +40,44 @@ AWS_URL_PREFIX = "https://s3.amazonaws.com/"
 
 # ZENDESK_FILE = os.path.join(os.getcwd(), "zendesk.json")
 ZENDESK_FILE = "zendesk.json"
+# ids of the articles archived so far, while archiving the book
+ZENDESK_ARCHIVE_FILE = "zendesk_archive_checkpoint.txt"
+# what is kept of the articles already on zendesk, without their bodies
+REMOTE_ARTICLE_KEYS = ["id", "title", "section_id", "html_url", "draft", "updated_at"]
+ZENDESK_TIMESTAMP_FORMAT = "%m-%d-%Y:%H:%M:%SZ"
+# what zendesk.json keeps for every file of the TOC
+MANIFEST_KEYS = [
+    "section_name",
+    "section_id",
+    "html_file_path",
+    "article_id",
+    "article_html_url",
+    "digest",
+    "synced_at",
+    "source_digest",
+    "synced_state",
+]
+# fields zendesk keeps on an article and on its translation for a locale,
+# draft belongs to the translation
+ARTICLE_METADATA_KEYS = [
+    "section_id",
+    "label_names",
+    "user_segment_id",
+    "permission_group_id",
+]
+ARTICLE_TRANSLATION_KEYS = ["title", "body", "draft"]
+# links to articles that are not created yet, see index_article_urls
+PLACEHOLDER_URL_PREFIX = "zendesk-placeholder:"
+# body of a new article until the urls it links to are known
+STUB_ARTICLE_BODY = "<p>This article is being published.</p>"
+# digests of the book sources at the last build, kept with the build output
+BUILD_FINGERPRINTS_FILE = "zendesk_fingerprints.json"
+BOOK_CONFIG_FILENAMES = ["_config.yml", "_config.yaml", "_toc.yml", "_toc.yaml"]
+SOURCE_SUFFIXES = [".md", ".ipynb", ".rst", ".myst"]
+IMAGE_SUFFIXES = [".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp"]
+BUILD_TIMINGS_EXTENSION = "jupyterbook_to_zendesk.commands.build_timings"
+# _config.yml with the execute options of build-jb, for jupyter-book build
+EXECUTION_CONFIG_FILE = "_config.zendesk.yml"
 EXCLUDED_HTML_FILENAMES = [
     "index",
     "genindex",
@@ -61,6 +112,33 @@ ARTICLE_DICT = {
 }
 
 
+def load_config(config_file):
+    # imported here, config.py is only needed by the commands reading
+    # config.cfg and not by the rest of this module
+    from jupyterbook_to_zendesk.config import Config
+
+    return Config(config_file)
+
+
+def get_config_option(App, key, default=None):
+    # optional settings, config.cfg files written before them do not have them
+    try:
+        value = App.get(key)
+    except Exception:
+        value = None
+    return default if value in (None, "") else value
+
+
+def get_help_center(App):
+    requests_per_minute = get_config_option(App, "zendesk_requests_per_minute")
+    return HelpCenter(
+        App.get("url"),
+        App.get("username"),
+        App.get("token"),
+        requests_per_minute=float(requests_per_minute) if requests_per_minute else None,
+    )
+
+
 def read_toc_yaml(yaml_file):
     logger.info(f"Reading TOC yaml file: {yaml_file}")
     toc_dict = {}
@@ -77,15 +155,258 @@ def read_toc_yaml(yaml_file):
     return toc_dict
 
 
-def gen_jupyter_book(source_folder_path, cwd=None):
-    cmd_string = f"jupyter-book build {source_folder_path}"
-    result = subprocess.run(cmd_string, shell=True, cwd=cwd)
-    st_code = result.returncode
-    logger.info(f"jupyter-book build STATUS CODE = {st_code}")
-    if st_code != OK_CODE:
+def find_source_file(source_folder_path, toc_file):
+    # TOC entries usually leave out the suffix of the file
+    source_file_path = os.path.join(source_folder_path, toc_file)
+    if os.path.isfile(source_file_path):
+        return source_file_path
+    for suffix in SOURCE_SUFFIXES:
+        if os.path.isfile(source_file_path + suffix):
+            return source_file_path + suffix
+    return None
+
+
+def find_book_images(source_folder_path):
+    # image file name to the digests of the images with that name
+    images = {}
+    for suffix in IMAGE_SUFFIXES:
+        pattern = os.path.join(source_folder_path, "**", "*" + suffix)
+        for image_file_path in glob(pattern, recursive=True):
+            relative_path = os.path.relpath(image_file_path, source_folder_path)
+            if "_build" in relative_path.split(os.sep):
+                continue
+            images.setdefault(os.path.basename(image_file_path), []).append(
+                file_digest(image_file_path)
+            )
+    return images
+
+
+def source_fingerprints(source_folder_path):
+    """Digests of the sources of the book.
+
+    "book" covers _config.yml and the TOC, "files" every file of the TOC
+    together with the images its source mentions by file name.
+    """
+    book_hash = hashlib.sha256()
+    for filename in BOOK_CONFIG_FILENAMES:
+        config_file_path = os.path.join(source_folder_path, filename)
+        if os.path.isfile(config_file_path):
+            book_hash.update(filename.encode("utf-8"))
+            book_hash.update(file_digest(config_file_path).encode("utf-8"))
+
+    images = find_book_images(source_folder_path)
+    files = {}
+    for f in gen_list_of_sections_and_html_files(source_folder_path):
+        source_file_path = find_source_file(source_folder_path, f["toc_file"])
+        if source_file_path is None:
+            files[f["toc_file"]] = None
+            continue
+        with open(source_file_path, "rb") as source_file:
+            source = source_file.read()
+        file_hash = hashlib.sha256(source)
+        text = source.decode("utf-8", errors="ignore")
+        for image_name in sorted(images):
+            if image_name in text:
+                file_hash.update(image_name.encode("utf-8"))
+                file_hash.update("".join(sorted(images[image_name])).encode("utf-8"))
+        files[f["toc_file"]] = file_hash.hexdigest()
+    return {"book": book_hash.hexdigest(), "files": files}
+
+
+def read_build_fingerprints(source_folder_path):
+    fingerprints_path = os.path.join(
+        source_folder_path, "_build", BUILD_FINGERPRINTS_FILE
+    )
+    try:
+        with open(fingerprints_path, "r") as f:
+            return json.loads(f.read())
+    except:  # never built incrementally, or the build was deleted
+        return None
+
+
+def parse_build_jobs(jobs):
+    # "auto" is a sphinx worker per cpu, like sphinx-build -j auto
+    if jobs in (None, ""):
+        return None
+    if str(jobs).strip().lower() == "auto":
+        return os.cpu_count() or 1
+    return max(int(jobs), 1)
+
+
+def execution_config(execute_notebooks=None, cache=None, timeout=None):
+    # the execute section of _config.yml, with only the options that were set.
+    # myst-nb only takes a cache folder in cache mode
+    if cache and execute_notebooks is None:
+        execute_notebooks = "cache"
+    execution = {
+        "execute_notebooks": execute_notebooks,
+        "cache": os.path.abspath(cache) if cache else None,
+        "timeout": timeout,
+    }
+    return {key: value for key, value in execution.items() if value is not None}
+
+
+def build_jupyter_book_in_process(source_folder_path, jobs=None, execution=None):
+    """Build the book through the jupyter-book python API.
+
+    Saves starting python and sphinx for every build, runs up to jobs
+    sphinx workers and returns the seconds spent per phase of the build.
+    execution overrides the execute section of _config.yml.
+    """
+    from pathlib import Path
+
+    from jupyter_book.config import get_final_config
+    from jupyter_book.sphinx import build_sphinx
+
+    from jupyterbook_to_zendesk.commands import build_timings
+
+    toc_file_path = os.path.join(source_folder_path, "_toc.yml")
+    if not os.path.exists(toc_file_path):
+        toc_file_path = os.path.join(source_folder_path, "_toc.yaml")
+    config_file_path = os.path.join(source_folder_path, "_config.yml")
+    if not os.path.exists(config_file_path):
+        config_file_path = None
+    execution_config_path = None
+    if execution:
+        # jupyter-book maps the execute section to the myst-nb options of
+        # the installed version, as for jupyter-book build --config
+        execution_config_path = write_execution_config(source_folder_path, execution)
+        config_file_path = execution_config_path
+
+    # the options jupyter-book build passes, plus the timing extension
+    cli_config = {
+        "external_toc_path": Path(toc_file_path).as_posix(),
+        "latex_individualpages": False,
+    }
+    try:
+        sphinx_config, _ = get_final_config(
+            user_yaml=Path(config_file_path) if config_file_path else None,
+            cli_config=dict(cli_config),
+            sourcedir=Path(source_folder_path),
+        )
+        cli_config["extensions"] = sphinx_config["extensions"] + [
+            BUILD_TIMINGS_EXTENSION
+        ]
+
+        build_timings.reset()
+        started = time.perf_counter()
+        result = build_sphinx(
+            source_folder_path,
+            os.path.join(source_folder_path, "_build", "html"),
+            noconfig=True,
+            path_config=config_file_path,
+            confoverrides=cli_config,
+            builder="html",
+            jobs=jobs,
+        )
+    finally:
+        if execution_config_path:
+            os.remove(execution_config_path)
+    logger.info(f"jupyter-book build STATUS CODE = {result}")
+    if result != OK_CODE:
         print("Error in creating Jupyter Book.")
         exit(1)
 
+    timings = {"read": 0.0, "execute": 0.0, "write": 0.0, "documents": 0}
+    timings.update(build_timings.timings)
+    timings["total"] = time.perf_counter() - started
+    # loading sphinx and its extensions, and everything around the phases
+    phases = timings["read"] + (timings["execute"] or 0.0) + timings["write"]
+    timings["setup"] = max(timings["total"] - phases, 0.0)
+    # None when myst-nb keeps no execution data, reading includes it then
+    execute = "unavailable"
+    if timings["execute"] is not None:
+        execute = f"{timings['execute']:.1f}s"
+    logger.info(
+        f"jupyter-book build read {timings['documents']} documents in "
+        f"{timings['total']:.1f}s: setup {timings['setup']:.1f}s, "
+        f"read {timings['read']:.1f}s, execute notebooks {execute}, "
+        f"write {timings['write']:.1f}s"
+    )
+    return timings
+
+
+def write_execution_config(source_folder_path, execution):
+    # jupyter-book build only takes the execute options from a config file
+    config_file_path = os.path.join(source_folder_path, "_config.yml")
+    config = {}
+    if os.path.exists(config_file_path):
+        with open(config_file_path, "r") as f:
+            config = yaml.safe_load(f) or {}
+    config["execute"] = dict(config.get("execute") or {}, **execution)
+    execution_config_path = os.path.join(source_folder_path, EXECUTION_CONFIG_FILE)
+    with open(execution_config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    return execution_config_path
+
+
+def gen_jupyter_book(
+    source_folder_path,
+    cwd=None,
+    incremental=False,
+    in_process=False,
+    jobs=None,
+    execution=None,
+):
+    # incremental skips the build when no source changed since the last one
+    if incremental:
+        fingerprints = source_fingerprints(source_folder_path)
+        fingerprints["execution"] = execution or {}
+        if read_build_fingerprints(source_folder_path) == fingerprints:
+            logger.info("No source changed since the last build, skipping the build")
+            return
+
+    if execution and "cache" in execution:
+        # myst-nb only takes a cache folder that exists
+        os.makedirs(execution["cache"], exist_ok=True)
+
+    timings = None
+    if in_process:
+        try:
+            timings = build_jupyter_book_in_process(
+                source_folder_path, jobs, execution
+            )
+        except ImportError as e:
+            logger.warning(f"Cannot build in process ({e}), running jupyter-book")
+    if timings is None:
+        cmd_string = f"jupyter-book build {source_folder_path}"
+        execution_config_path = None
+        if execution:
+            execution_config_path = write_execution_config(
+                source_folder_path, execution
+            )
+            cmd_string = (
+                f"jupyter-book build --config {execution_config_path} "
+                f"{source_folder_path}"
+            )
+        try:
+            result = subprocess.run(cmd_string, shell=True, cwd=cwd)
+        finally:
+            if execution_config_path:
+                os.remove(execution_config_path)
+        st_code = result.returncode
+        logger.info(f"jupyter-book build STATUS CODE = {st_code}")
+        if st_code != OK_CODE:
+            print("Error in creating Jupyter Book.")
+            exit(1)
+    if incremental:
+        write_json_file(
+            os.path.join(source_folder_path, "_build", BUILD_FINGERPRINTS_FILE),
+            fingerprints,
+        )
+    return timings
+
+
+def sync_fingerprint(fingerprints, toc_file, options):
+    # what has to be the same as at the last sync for a page to be skipped
+    content = {
+        "book": fingerprints["book"],
+        "file": fingerprints["files"].get(toc_file),
+        "options": options,
+    }
+    content_json = json.dumps(content, sort_keys=True)
+    return hashlib.sha256(content_json.encode("utf-8")).hexdigest()
+
 
 def get_toc(source_folder_path):
     if os.path.exists(os.path.join(source_folder_path, "_toc.yaml")):
@@ -106,7 +427,11 @@ def gen_list_of_sections_and_html_files(source_folder_path):
     if "root" in toc:
         html_file_path = os.path.join(html_folder_path, str(toc["root"]) + ".html")
         html_files_list.append(
-            {"section_name": "Introduction", "html_file_path": html_file_path}
+            {
+                "toc_file": str(toc["root"]),
+                "section_name": "Introduction",
+                "html_file_path": html_file_path,
+            }
         )
 
     # TODO There are several jupyterbook _toc configurations that are possible
@@ -129,65 +454,322 @@ def gen_list_of_sections_and_html_files(source_folder_path):
                 filename = f["file"]
                 html_file_path = os.path.join(html_folder_path, str(filename) + ".html")
                 html_files_list.append(
-                    {"section_name": section, "html_file_path": html_file_path}
+                    {
+                        "toc_file": str(filename),
+                        "section_name": section,
+                        "html_file_path": html_file_path,
+                    }
                 )
     # logger.info(f"Final List of html files to be sent to Zendesk: \n {html_files_list}")
     logger.debug(cpprint(html_files_list))
     return html_files_list
 
 
-def upload_to_aws_s3(s3, local_file_path, bucket, s3_file_key):
+S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024  # boto3 TransferConfig default
+# content addressed keys never change their content, so they can be cached forever
+S3_CONTENT_ADDRESSED_PREFIX = "sha256/"
+S3_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def list_s3_objects(s3, bucket, prefix="", max_pages=None):
+    # one paginated listing of the bucket instead of a HEAD request per image,
+    # None when it takes more than max_pages requests
+    remote_objects = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for pages, page in enumerate(paginator.paginate(Bucket=bucket, Prefix=prefix), 1):
+        for obj in page.get("Contents", []):
+            remote_objects[obj["Key"]] = {
+                "size": obj["Size"],
+                "etag": obj["ETag"].strip('"'),
+            }
+        if page.get("IsTruncated") and max_pages is not None and pages >= max_pages:
+            return None
+    return remote_objects
+
+
+def head_s3_objects(s3, bucket, keys):
+    # a HEAD request per key, the keys that are not there are left out
+    remote_objects = {}
+    for key in keys:
+        try:
+            response = s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                continue
+            raise
+        remote_objects[key] = {
+            "size": response["ContentLength"],
+            "etag": response["ETag"].strip('"'),
+        }
+    return remote_objects
+
+
+def find_s3_objects(s3, bucket, keys):
+    # lists the common prefix of keys, the images of a book usually share one,
+    # and falls back to a HEAD request per key once listing takes as many
+    # requests, the keys are a small part of a large bucket then
+    keys = sorted(set(keys))
+    remote_objects = list_s3_objects(
+        s3, bucket, os.path.commonprefix(keys), max_pages=len(keys)
+    )
+    if remote_objects is None:
+        remote_objects = head_s3_objects(s3, bucket, keys)
+    return remote_objects
+
+
+def s3_etag(local_file_path, chunk_size=S3_MULTIPART_CHUNKSIZE):
+    # the ETag S3 gives an object uploaded by upload_file: the md5 of the file,
+    # or for multipart uploads the md5 of the part md5s with the part count
+    part_md5s = []
+    with open(local_file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            part_md5s.append(hashlib.md5(chunk))
+    if not part_md5s:
+        return hashlib.md5(b"").hexdigest()
+    if len(part_md5s) == 1:
+        return part_md5s[0].hexdigest()
+    parts = b"".join(part_md5.digest() for part_md5 in part_md5s)
+    return f"{hashlib.md5(parts).hexdigest()}-{len(part_md5s)}"
+
+
+def s3_object_matches(remote_objects, local_file_path, s3_file_key):
+    remote = remote_objects.get(s3_file_key)
+    if not remote or remote["size"] != os.path.getsize(local_file_path):
+        return False
+    return remote["etag"] == s3_etag(local_file_path)
+
+
+def content_addressed_s3_key(digest, local_file_path):
+    extension = os.path.splitext(local_file_path)[1].lower()
+    return S3_CONTENT_ADDRESSED_PREFIX + digest + extension
+
+
+def upload_to_aws_s3(
+    s3, local_file_path, bucket, s3_file_key, remote_objects=None, cache_control=None
+):
+    # pass the listing from list_s3_objects to skip files that are already there
+    if remote_objects is not None and s3_object_matches(
+        remote_objects, local_file_path, s3_file_key
+    ):
+        logger.info(f"{local_file_path}: Unchanged on S3, skipping upload")
+        return True
+    extra_args = {"ACL": "public-read"}
+    if cache_control:
+        extra_args["CacheControl"] = cache_control
     try:
-        s3.upload_file(
-            local_file_path, bucket, s3_file_key, ExtraArgs={"ACL": "public-read"}
-        )
+        s3.upload_file(local_file_path, bucket, s3_file_key, ExtraArgs=extra_args)
         logger.info(f"{local_file_path}: Upload Successful")
         return True
     except Exception as e:
-        logger.error(f"{local_file_path}: Some Error occured uploading. \n", e, "\n")
+        logger.error(f"{local_file_path}: Some Error occured uploading. {e}")
         return False
 
 
-def update_article_dict(html_file_path, s3, aws_s3_bucket, article_dict=deepcopy(ARTICLE_DICT)):
-    with open(html_file_path, "r") as f:
-        soup = bs4(f.read(), "html.parser")
+def is_external_url(url):
+    return (
+        url.startswith("https://")
+        or url.startswith("http://")
+        or url.startswith("mailto:")
+        or url.startswith("#")
+    )
+
 
-    article_dict["article"]["title"] = soup.title.text.strip()
+def parse_article_html(html_file_path, parser=None):
+    # parse a built page once and keep its cleaned main content in memory.
+    # the img and a tags that point inside the book are collected in the
+    # same walk, so rewriting them later never touches the rest of the tree
+    with open(html_file_path, "r") as f:
+        soup = bs4(f.read(), parser or HTML_PARSER)
 
+    title = soup.title.text.strip()
     soup = soup_cleanup(soup)
-    # TODO Add labels
     labels = soup_find_labels(soup)
 
     # extract out main content of the html page
     msoup = soup.find(id="main-content")
-    # find all image references in main content
-    img_tags = msoup.find_all("img")
-    for tag in img_tags:
-        img_url = tag["src"]
-        if img_url.startswith("https://") or img_url.startswith("http://"):
-            continue
-        img_file_path = os.path.join(os.path.dirname(html_file_path), img_url)
-        img_s3_file_key = os.path.basename(img_url)
-        status = upload_to_aws_s3(s3, img_file_path, aws_s3_bucket, img_s3_file_key)
-        # fix url to point to aws s3 instead of local path
-        tag["src"] = AWS_URL_PREFIX + aws_s3_bucket + "/" + img_s3_file_key
-    article_dict["article"]["body"] = msoup.prettify(formatter="html5")
-    with open(html_file_path, "w") as oFile:  # write the file back to disk
-        # formatter html to retain &nbsp; etc.
-        oFile.write(soup.prettify(formatter="html5"))
-        oFile.close()
+    img_tags, a_tags = [], []
+    for tag in msoup.find_all(["img", "a"]):
+        if tag.name == "img" and not is_external_url(tag.get("src", "#")):
+            img_tags.append(tag)
+        elif tag.name == "a" and not is_external_url(tag.get("href", "#")):
+            # keep the original href, links are resolved against it
+            a_tags.append((tag, tag["href"]))
+
+    return {
+        "html_file_path": html_file_path,
+        "title": title,
+        "labels": labels,
+        "main_content": msoup,
+        "img_tags": img_tags,
+        "a_tags": a_tags,
+    }
 
+
+def render_article_dict(page, article_dict=None):
+    # every call needs its own copy, the sync workers run this concurrently
+    if article_dict is None:
+        article_dict = deepcopy(ARTICLE_DICT)
+    article_dict["article"]["title"] = page["title"]
+    article_dict["article"]["label_names"] = page["labels"]
+    # formatter html to retain &nbsp; etc.
+    article_dict["article"]["body"] = page["main_content"].prettify(
+        formatter="html5"
+    )
     return article_dict
 
 
-def article_exists(articles, title, section_id):
+def file_digest(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def collect_book_images(pages, content_addressed=False):
+    # group every local image reference of the book by the content of the file,
+    # the same logo used on every page ends up as a single entry.
+    # content addressed keys also keep images/z.jpg and img2/z.jpg apart
+    images = {}  # digest -> image
+    digests = {}  # file path -> digest, each file is read once
+    for page in pages:
+        html_dir = os.path.dirname(page["html_file_path"])
+        for tag in page["img_tags"]:
+            img_url = tag["src"]
+            if is_external_url(img_url):  # already rewritten
+                continue
+            img_file_path = os.path.normpath(os.path.join(html_dir, img_url))
+            if img_file_path not in digests:
+                try:
+                    digests[img_file_path] = file_digest(img_file_path)
+                except OSError as e:
+                    logger.warning(f"{img_file_path}: Unable to read image. {e}")
+                    digests[img_file_path] = None
+            digest = digests[img_file_path]
+            if digest is None:
+                continue
+            if digest not in images:
+                if content_addressed:
+                    s3_file_key = content_addressed_s3_key(digest, img_file_path)
+                else:
+                    s3_file_key = os.path.basename(img_url)
+                images[digest] = {
+                    "digest": digest,
+                    "img_file_path": img_file_path,
+                    "size": os.path.getsize(img_file_path),
+                    "s3_file_key": s3_file_key,
+                    "tags": [],
+                    "html_file_paths": [],
+                }
+            images[digest]["tags"].append(tag)
+            if page["html_file_path"] not in images[digest]["html_file_paths"]:
+                images[digest]["html_file_paths"].append(page["html_file_path"])
+    return list(images.values())
+
+
+def upload_book_images(pages, backend, workers=1, skip_unchanged=False):
+    # upload every distinct image of the book once and point all of its img
+    # tags to the backend, see image_backends.py. Has to run before the
+    # article bodies are rendered.
+    images = collect_book_images(pages, backend.content_addressed)
+    backend.prepare(images, skip_unchanged)
+
+    def upload(image):
+        start = time.perf_counter()
+        image["skipped"] = skip_unchanged and backend.is_uploaded(image)
+        image["failed"] = False
+        if image["skipped"]:
+            logger.info(
+                f"{image['img_file_path']}: Unchanged on {backend.label}, "
+                "skipping upload"
+            )
+        else:
+            image["failed"] = not backend.upload(image)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    durations = map_with_workers(upload, images, workers=workers)
+    seconds = time.perf_counter() - start
+    backend.save()
+
+    for image in images:
+        # fix url to point to the backend instead of local path, the img tags
+        # of an image that failed to upload are left alone
+        url = None if image["failed"] else backend.url(image)
+        if url is None:
+            continue
+        for tag in image["tags"]:
+            tag["src"] = url
+
+    # uploading every reference one after the other is what this replaces
+    references = sum(len(image["tags"]) for image in images)
+    bytes_uploaded = sum(
+        image["size"]
+        for image in images
+        if not image["skipped"] and not image["failed"]
+    )
+    bytes_referenced = sum(image["size"] * len(image["tags"]) for image in images)
+    seconds_referenced = sum(
+        duration * len(image["tags"]) for image, duration in zip(images, durations)
+    )
+    stats = {
+        "images": len(images),
+        "skipped": sum(1 for image in images if image["skipped"]),
+        "failed": sum(1 for image in images if image["failed"]),
+        "references": references,
+        "bytes_uploaded": bytes_uploaded,
+        "bytes_saved": bytes_referenced - bytes_uploaded,
+        "seconds": seconds,
+        "seconds_saved": max(seconds_referenced - seconds, 0.0),
+    }
+    uploaded = stats["images"] - stats["skipped"] - stats["failed"]
+    logger.info(
+        f"Uploaded {uploaded} of {stats['images']} images "
+        f"({stats['bytes_uploaded']} bytes, {stats['skipped']} unchanged, "
+        f"{stats['failed']} failed) "
+        f"for {stats['references']} references in {stats['seconds']:.2f}s, "
+        f"saved {stats['bytes_saved']} bytes and {stats['seconds_saved']:.2f}s"
+    )
+    return stats
+
+
+def index_articles_by_title(articles):
+    # (title, section id) to article, built once per sync,
+    # the first article with a title in a section wins
+    articles_by_title = {}
     for article in articles["articles"]:
-        if article["title"] == title:
-            return article
-    return False
+        articles_by_title.setdefault((article["title"], article["section_id"]), article)
+    return articles_by_title
+
+
+def article_exists(articles_by_title, title, section_id):
+    return articles_by_title.get((title, section_id), False)
 
 
-def find_matching_url(url, html_files_for_zendesk):
+def placeholder_url(toc_file):
+    return PLACEHOLDER_URL_PREFIX + toc_file
+
+
+def has_placeholder_links(article_dict):
+    return PLACEHOLDER_URL_PREFIX in article_dict["article"]["body"]
+
+
+def index_article_urls(html_files_for_zendesk):
+    # html file name to the paths and zendesk urls of the files with that name,
+    # files without an article yet get a placeholder url
+    article_urls = {}
+    for item in html_files_for_zendesk:
+        html_file_path = item["html_file_path"]
+        article_html_url = item.get("article_html_url")
+        if article_html_url is None:
+            article_html_url = placeholder_url(item["toc_file"])
+        article_urls.setdefault(os.path.basename(html_file_path), []).append(
+            (html_file_path, article_html_url)
+        )
+    return article_urls
+
+
+def find_matching_url(url, article_urls):
     html_url, rhs_url, lhs_url = url, "", ""
     if "#" in url:
         hash_loc = url.find("#")
@@ -196,9 +778,10 @@ def find_matching_url(url, html_files_for_zendesk):
         dot_loc = lhs_url.find(".")
         html_url = lhs_url[:dot_loc] + ".html"
 
-    for item in html_files_for_zendesk:
-        if item["html_file_path"].endswith(html_url):
-            zendesk_url = item["article_html_url"]
+    for html_file_path, zendesk_url in article_urls.get(
+        os.path.basename(html_url), []
+    ):
+        if html_file_path.endswith(html_url):
             matching_url = zendesk_url + rhs_url
             return matching_url
     logger.warning(f"For {html_url}, Matching URL not found on Zendesk")
@@ -210,7 +793,7 @@ def soup_find_labels(soup):
     element = soup.find("meta", {"name": "labels"})
     labels = []
     if element:
-        if "content" in element:
+        if element.get("content"):
             t_labels = element["content"].split(",")
             for label in t_labels:
                 labels.append(label.strip())
@@ -229,45 +812,25 @@ def soup_cleanup(soup):
     return soup
 
 
-def update_urls_in_article_dict(
-    html_file_path, html_files_for_zendesk, article_dict=deepcopy(ARTICLE_DICT)
-):
-    with open(html_file_path, "r") as f:
-        soup = bs4(f.read(), "html.parser")
-
-    soup = soup_cleanup(soup)
-    labels = soup_find_labels(soup)
+def update_urls_in_article_dict(page, article_urls, article_dict=None):
+    # works on the page cached by parse_article_html in the 1st pass,
+    # article_urls comes from index_article_urls
+    for tag, a_url in page["a_tags"]:
+        tag["href"] = find_matching_url(a_url, article_urls)
 
-    article_dict["article"]["title"] = soup.title.text.strip()
-    # extract out main content of the html page
-    msoup = soup.find(id="main-content")
-    a_tags = msoup.find_all("a")
-    for tag in a_tags:
-        if "href" in tag:
-            a_url = tag["href"]
-            if (
-                a_url.startswith("https://")
-                or a_url.startswith("http://")
-                or a_url.startswith("mailto:")
-                or a_url.startswith("#")
-            ):
-                continue
-            else:
-                new_url = find_matching_url(a_url, html_files_for_zendesk)
-                tag["href"] = new_url
-    article_dict["article"]["body"] = msoup.prettify(formatter="html5")
-    with open(html_file_path, "w") as oFile:  # write the file back to disk
-        # formatter html to retain &nbsp; etc.
-        oFile.write(soup.prettify(formatter="html5"))
-        oFile.close()
-    return article_dict
+    return render_article_dict(page, article_dict)
 
 
-def find_section_name_in_list(section_name, sections_resp, category_id):
+def index_sections(sections_resp):
+    # (section name, category id) to section id, the first section wins
+    sections_by_name = {}
     for item in sections_resp["sections"]:
-        if item["name"] == section_name and item["category_id"] == category_id:
-            return item["id"]
-    return NOT_FOUND
+        sections_by_name.setdefault((item["name"], item["category_id"]), item["id"])
+    return sections_by_name
+
+
+def find_section_name_in_list(section_name, sections_by_name, category_id):
+    return sections_by_name.get((section_name, category_id), NOT_FOUND)
 
 
 def setup_section_on_zendesk(hc, section_name, zendesk_category_id):
@@ -283,71 +846,235 @@ def setup_section_on_zendesk(hc, section_name, zendesk_category_id):
         return NOT_FOUND
 
 
-def handle_sections_on_zendesk(hc, html_files_list, zendesk_category_id):
-    # will check if all sections exist on Zendesk in the category
-    # if not, will create the section on Zendesk
-    # will update
-    sections_resp = hc.list_all_sections()
-
-    html_files_for_zendesk = []
+def handle_sections_on_zendesk(
+    hc, html_files_list, zendesk_category_id, known_sections=None, workers=1
+):
+    """Find or create the section of every file in the category.
 
+    known_sections, section name to id as kept in zendesk.json, saves
+    every call when it has all the sections of the TOC. Otherwise the
+    sections of the category are listed once and the missing ones are
+    created together, up to workers at a time.
+    """
+    section_names = []
     for item in html_files_list:
-        section_name = item["section_name"]
-        section_id = find_section_name_in_list(
-            section_name, sections_resp, zendesk_category_id
-        )
+        if item["section_name"] not in section_names:
+            section_names.append(item["section_name"])
+
+    def missing_sections(sections_by_name):
+        return [
+            section_name
+            for section_name in section_names
+            if find_section_name_in_list(
+                section_name, sections_by_name, zendesk_category_id
+            )
+            == NOT_FOUND
+        ]
+
+    sections_by_name = {
+        (section_name, zendesk_category_id): section_id
+        for section_name, section_id in (known_sections or {}).items()
+    }
+    missing = missing_sections(sections_by_name)
+    if missing:
+        # only the sections of the category, not the whole help center
+        sections = hc.iter_sections_by_category(zendesk_category_id)
+        sections_by_name = index_sections({"sections": list(sections)})
+        missing = missing_sections(sections_by_name)
+
+    def create_section(section_name):
+        section_resp = setup_section_on_zendesk(hc, section_name, zendesk_category_id)
+        if section_resp == NOT_FOUND:
+            return NOT_FOUND
+        try:
+            return section_resp["section"]["id"]
+        except Exception as e:
+            logger.warn("Exception adding section id")
+            logger.exception(e)
+            return NOT_FOUND
+
+    created = map_with_workers(create_section, missing, workers=workers)
+    for section_name, section_id in zip(missing, created):
         if section_id == NOT_FOUND:
-            # set up section on zendesk
-            section_resp = setup_section_on_zendesk(
-                hc, section_name, zendesk_category_id
+            logger.error(
+                f"Could not create section name: {section_name} on Zendesk. Please check, cleanup and retry"
             )
-            if section_resp == NOT_FOUND:
-                logger.error(
-                    f"Could not create section name: {section_name} on Zendesk. Please check, cleanup and retry"
-                )
-                exit(1)
-            else:
-                # logger.info(sections_resp)
-                logger.info("Here is 1 section")
-                # logger.info(cpprint(section_resp))
-                try:
-                    sections_resp["sections"].append(section_resp["section"])
-                    section_id = section_resp["section"]["id"]
-                except Exception as e:
-                    logger.warn("Exception adding section id")
-                    logger.exception(e)
+            exit(1)
+        sections_by_name[(section_name, zendesk_category_id)] = section_id
+    if missing:
+        logger.info(f"Created {len(missing)} sections on Zendesk")
 
+    html_files_for_zendesk = []
+    for item in html_files_list:
         html_files_for_zendesk.append(
             {
+                "toc_file": item["toc_file"],
                 "section_name": item["section_name"],
-                "section_id": section_id,
+                "section_id": find_section_name_in_list(
+                    item["section_name"], sections_by_name, zendesk_category_id
+                ),
                 "html_file_path": item["html_file_path"],
             }
         )
     return html_files_for_zendesk
 
 
+def toc_file_from_html_path(html_file_path):
+    # <source>/_build/html/<toc file>.html
+    html_folder_path = os.path.join("_build", "html") + os.sep
+    toc_file = html_file_path.split(html_folder_path, 1)[-1]
+    return os.path.splitext(toc_file)[0]
+
+
 def read_zendesk_json(zendesk_file_path):
+    """The sync manifest: every file of the TOC with its zendesk article.
+
+        {
+            "timestamp": "...",
+            "category_name": "...",
+            "category_id": ...,
+            "sections": {"<section name>": <section id>, ...},
+            "files": {"<toc file>": {"article_id": ..., ...}},
+        }
+
+    zendesk.json files written before the manifest, with a list of
+    articles, are read into the same layout.
+    """
     try:
         with open(zendesk_file_path, "r") as f:
             zendesk_json_pre = json.loads(f.read())
     except:  # probably a new book so no file OR an empty file OR not a valid json file
-        zendesk_json_pre = {"timestamp": "", "articles": []}
+        zendesk_json_pre = {"timestamp": "", "files": {}}
+    if "files" not in zendesk_json_pre:
+        files = {}
+        for item in zendesk_json_pre.get("articles", []):
+            if "html_file_path" in item:
+                toc_file = toc_file_from_html_path(item["html_file_path"])
+                files.setdefault(toc_file, item)
+        zendesk_json_pre = {
+            "timestamp": zendesk_json_pre.get("timestamp", ""),
+            "files": files,
+        }
     return zendesk_json_pre
 
 
+def write_json_file(file_path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    # write to a temp file first so an interrupted sync never leaves half a file
+    tmp_file_path = file_path + ".tmp"
+    with open(tmp_file_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_file_path, file_path)
+
+
+def write_zendesk_json(
+    zendesk_file_path, html_files_for_zendesk, category_name=None, category_id=None
+):
+    files = {}
+    for f in html_files_for_zendesk:
+        files[f["toc_file"]] = {key: f[key] for key in MANIFEST_KEYS if key in f}
+    zendesk_json = {
+        "timestamp": datetime.utcnow().strftime(ZENDESK_TIMESTAMP_FORMAT),
+        "files": files,
+    }
+    if category_id is not None:
+        # lets the next sync skip looking up the category and its sections
+        zendesk_json["category_name"] = category_name
+        zendesk_json["category_id"] = category_id
+        zendesk_json["sections"] = {
+            f["section_name"]: f["section_id"]
+            for f in html_files_for_zendesk
+            if f.get("section_id", NOT_FOUND) != NOT_FOUND
+        }
+    write_json_file(zendesk_file_path, zendesk_json)
+    logger.info(f"Saved sync state to: {zendesk_file_path}")
+
+
+def manifest_category_id(zendesk_json_pre, zendesk_category_name):
+    # the category id zendesk.json has for the category name, or None
+    if zendesk_json_pre.get("category_name") != zendesk_category_name:
+        return None
+    return zendesk_json_pre.get("category_id")
+
+
+def manifest_sections(zendesk_json_pre, category_id):
+    # section name to id, for the sections zendesk.json has in the category
+    if zendesk_json_pre.get("category_id") != category_id:
+        return {}
+    return zendesk_json_pre.get("sections", {})
+
+
+def remote_article_record(article):
+    return {key: article.get(key) for key in REMOTE_ARTICLE_KEYS}
+
+
+def list_remote_articles(hc, category_id):
+    """Articles of the category on zendesk, laid out like list_articles_by_category.
+
+    Only needed by a sync without zendesk.json, article bodies are not
+    kept, matching only needs titles and sections.
+    """
+    articles = [
+        remote_article_record(article)
+        for article in hc.iter_articles_by_category(category_id)
+    ]
+    logger.info(f"Listed {len(articles)} articles of the category on Zendesk")
+    return {"articles": articles}
+
+
+def article_digest(article_dict):
+    # digest of everything that ends up on zendesk for an article
+    # if it matches the one in zendesk.json there is nothing to send
+    article = article_dict["article"]
+    content = {
+        "title": article["title"],
+        "body": article["body"],
+        "label_names": article["label_names"],
+        "draft": article["draft"],
+        "user_segment_id": article["user_segment_id"],
+    }
+    content_json = json.dumps(content, sort_keys=True)
+    return hashlib.sha256(content_json.encode("utf-8")).hexdigest()
+
+
+def article_state(article):
+    # the fields of an article as sent to zendesk, kept in zendesk.json to
+    # diff the next sync against. The body is only kept as its digest
+    state = {
+        key: article[key]
+        for key in ARTICLE_METADATA_KEYS + ARTICLE_TRANSLATION_KEYS
+        if key in article
+    }
+    if "body" in state:
+        state["body"] = hashlib.sha256(state["body"].encode("utf-8")).hexdigest()
+    return state
+
+
+def plan_article_update(article, synced_state=None):
+    """Split the fields of article that differ from synced_state by endpoint.
+
+    Returns the article fields to PUT to update_article_metadata and the
+    translation fields to PUT to update_article_translation, either is
+    empty when nothing it covers changed. Without a synced_state, for
+    articles adopted from zendesk, every field is sent.
+    """
+    state = article_state(article)
+    changed = {
+        key
+        for key in state
+        if synced_state is None
+        or key not in synced_state
+        or synced_state[key] != state[key]
+    }
+    metadata = {key: article[key] for key in ARTICLE_METADATA_KEYS if key in changed}
+    translation = {
+        key: article[key] for key in ARTICLE_TRANSLATION_KEYS if key in changed
+    }
+    return metadata, translation
+
+
 def file_exists_on_zendesk(file_dict, zendesk_json_pre):
-    # first find if file exists in zendesk_json_pre
-    # logger.info(cpprint(file_dict))
-    # if len(zendesk_json_pre["articles"]):
-    #     logger.info(cpprint(zendesk_json_pre["articles"][0]))
-    html_file_path = file_dict["html_file_path"]
-    for item in zendesk_json_pre["articles"]:
-        if "html_file_path" in item:
-            if item["html_file_path"] == html_file_path:  # file exists in pre
-                # now we check if it exists on zendesk (TBD)
-                return item
-    return NOT_FOUND
+    return zendesk_json_pre["files"].get(file_dict["toc_file"], NOT_FOUND)
 
 
 def check_category_on_zendesk(hc, zendesk_category_name):
@@ -391,27 +1118,115 @@ def check_user_on_zendesk(hc):
         exit(1)
 
 
-def archive_book_from_zendesk(hc, zendesk_json_pre, zendesk_file_path):
-    articles = zendesk_json_pre["articles"]
+def read_archive_checkpoint(checkpoint_file_path):
+    # ids of the articles an earlier, interrupted archive got through
+    try:
+        with open(checkpoint_file_path, "r") as f:
+            return {int(line) for line in f if line.strip()}
+    except OSError:
+        return set()
+
+
+def archive_book_from_zendesk(
+    hc, zendesk_json_pre, zendesk_file_path, workers=1, checkpoint_file_path=None
+):
+    """Archive every article of zendesk.json, up to workers at a time.
+
+    The id of every archived article is appended to checkpoint_file_path
+    right away, an interrupted archive started again skips those. Once all
+    articles are archived zendesk.json is emptied and the checkpoint removed.
+    Returns False when some articles could not be archived.
+    """
+    articles = [
+        (toc_file, f["article_id"])
+        for toc_file, f in zendesk_json_pre["files"].items()
+        if "article_id" in f
+    ]
     if len(articles) < 1:
         logger.info("No articles found in the zendesk.json file to Archive")
-        return
-    for article in articles:
-        article_id = article["article_id"]
-        html_file_path = article["html_file_path"]
-        logger.info(f"Archiving: {html_file_path} at Zendesk, Article ID:{article_id}")
-        resp = hc.archive_article(article_id, locale="en-us")
-        status_code = resp["status_code"]
-        if status_code == 204:
-            logger.info(f"{article_id} Successfully Archived")
-        else:
-            logger.warning(
-                f"Error occured in Archiving: {article_id}. HTTP Code = {status_code}"
-            )
+        return True
+
+    archived = set()
+    if checkpoint_file_path:
+        archived = read_archive_checkpoint(checkpoint_file_path)
+    pending = [article for article in articles if article[1] not in archived]
+    if len(pending) < len(articles):
+        skipped = len(articles) - len(pending)
+        logger.info(f"Resuming, {skipped} articles were archived already")
+
+    lock = threading.Lock()
+    progress = {"done": 0, "failed": 0}
+    log_every = max(len(pending) // 20, 1)
+    start = time.perf_counter()
+
+    def archive(article):
+        toc_file, article_id = article
+        logger.info(f"Archiving: {toc_file} at Zendesk, Article ID:{article_id}")
+        # Base.delete reports the status of a 204 or 404 only, any other
+        # answer is the error body or None
+        try:
+            resp = hc.archive_article(article_id, locale="en-us")
+        except Exception as e:
+            resp = {"error": str(e)}
+        status_code = None
+        if isinstance(resp, dict):
+            status_code = resp.get("status_code")
+        with lock:
+            if status_code in (204, 404):  # 404 is archived already
+                if checkpoint_file_path:
+                    with open(checkpoint_file_path, "a") as f:
+                        f.write(f"{article_id}\n")
+                progress["done"] += 1
+            else:
+                logger.warning(
+                    f"Error occured in Archiving: {article_id}. Response = {resp}"
+                )
+                progress["failed"] += 1
+            finished = progress["done"] + progress["failed"]
+            if finished % log_every == 0 or finished == len(pending):
+                seconds = time.perf_counter() - start
+                logger.info(
+                    f"Archived {progress['done']} of {len(pending)} articles, "
+                    f"{progress['failed']} failed, {finished / seconds:.1f} per second"
+                )
+        return status_code
+
+    map_with_workers(archive, pending, workers=workers)
+    if progress["failed"]:
+        logger.warning(
+            f"{progress['failed']} articles were not archived, run the archive again"
+        )
+        return False
+
     open(zendesk_file_path, "w").close()  # will rewrite zendesk.json to zero bytes
+    if checkpoint_file_path and os.path.exists(checkpoint_file_path):
+        os.remove(checkpoint_file_path)
     logger.info(
         f"Book archived at Zendesk. You can delete it manually from the Admin UI"
     )
+    return True
+
+
+def map_with_workers(func, items, workers=1):
+    # run func over items on a bounded thread pool, results come back in the
+    # same order as items. The first exception, or an interrupt, cancels
+    # everything that has not started yet, waits for the in-flight calls and
+    # is then re-raised.
+    if workers is None or workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        try:
+            wait(futures, return_when=FIRST_EXCEPTION)
+        finally:
+            # the calls that started run to the end, the pool waits for them
+            for future in futures:
+                future.cancel()
+    for future in futures:
+        if not future.cancelled() and future.exception() is not None:
+            raise future.exception()
+    return [future.result() for future in futures]
 
 
 def delete_local_html_of_book(source_folder_path):
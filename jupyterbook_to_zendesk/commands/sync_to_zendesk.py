@@ -7,12 +7,13 @@ import sys
 from datetime import datetime
 from pprint import pprint
 
-import boto3
 import click
 from prettyprinter import cpprint
 
+import jupyterbook_to_zendesk.commands.image_backends as image_backends
 import jupyterbook_to_zendesk.commands.md2zen as md
 from jupyterbook_to_zendesk.logging import logger
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import ZendeskError
 
 
 def sync(ctx):
@@ -20,9 +21,9 @@ def sync(ctx):
 
     # 0. Initialize Zendesk router & S3
 
-    App = md.Config(ctx.obj["config_file"])
+    App = md.load_config(ctx.obj["config_file"])
 
-    hc = md.HelpCenter(App.get("url"), App.get("username"), App.get("token"))
+    hc = md.get_help_center(App)
     try:
         hc.get_me()
     except Exception as e:
@@ -30,39 +31,56 @@ def sync(ctx):
         logger.exception(e)
         exit(1)
 
-    logger.info("Init s3 configuration")
+    # s3 or zendesk attachments, image_backend in config.cfg
+    logger.info("Init image backend")
     try:
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=App.get("aws_access_key"),
-            aws_secret_access_key=App.get("aws_secret"),
+        image_backend = image_backends.get_image_backend(
+            App,
+            hc,
+            ctx.obj["destination_dir"],
+            ctx.obj.get("content_addressed_images", False),
         )
     except Exception as e:
-        logger.warn("Error calling boto3.client")
+        logger.warn("Error setting up the image backend")
         logger.exception(e)
         exit(1)
 
-    # TODO add check that s3 bucket exists
-    aws_s3_bucket = App.get("aws_s3_bucket")
-
     # check if user exists on Zendesk and can do something on it.
     md.check_user_on_zendesk(hc)
 
     # load any previous zendesk activity on this source folder
     zendesk_file_path = os.path.join(ctx.obj["destination_dir"], md.ZENDESK_FILE)
 
-    category_id = md.check_category_on_zendesk(
-        hc=hc, zendesk_category_name=App.get("zendesk_category_name")
-    )
-    zendesk_json_pre = hc.list_articles_by_category(category_id=category_id)
-
+    # the category and section ids of the last sync are kept in zendesk.json
+    zendesk_state = md.read_zendesk_json(zendesk_file_path)
+    category_name = App.get("zendesk_category_name")
+    category_id = md.manifest_category_id(zendesk_state, category_name)
+    if category_id is None:
+        category_id = md.check_category_on_zendesk(
+            hc=hc, zendesk_category_name=category_name
+        )
     if ctx.obj["archive_flag"]:  # archive the book on Zendesk and exit OK.
-        md.archive_book_from_zendesk(hc, zendesk_json_pre, zendesk_file_path)
+        archive_file_path = os.path.join(
+            ctx.obj["destination_dir"], md.ZENDESK_ARCHIVE_FILE
+        )
+        workers = ctx.obj.get("workers", 1)
+        hc.set_pool_size(workers)
+        if not md.archive_book_from_zendesk(
+            hc,
+            zendesk_state,
+            zendesk_file_path,
+            workers=workers,
+            checkpoint_file_path=archive_file_path,
+        ):
+            exit(1)
+        attachments_file_path = os.path.join(
+            ctx.obj["destination_dir"], image_backends.ZENDESK_ATTACHMENTS_FILE
+        )
+        if os.path.exists(attachments_file_path):
+            os.remove(attachments_file_path)
         md.delete_local_html_of_book(ctx.obj["destination_dir"])
         exit(0)
 
-    aws_s3_bucket = App.get("aws_s3_bucket")
-
     try:
         html_files_for_zendesk = md.gen_list_of_sections_and_html_files(
             source_folder_path=ctx.obj["source_dir"]
@@ -72,97 +90,270 @@ def sync(ctx):
         logger.exception(e)
         exit(1)
 
+    workers = ctx.obj.get("workers", 1)
+    hc.set_pool_size(workers)
     html_files_for_zendesk = md.handle_sections_on_zendesk(
-        hc=hc, html_files_list=html_files_for_zendesk, zendesk_category_id=category_id
+        hc=hc,
+        html_files_list=html_files_for_zendesk,
+        zendesk_category_id=category_id,
+        known_sections=md.manifest_sections(zendesk_state, category_id),
+        workers=workers,
     )
 
-    zendesk_json_pre = hc.list_articles_by_category(category_id=category_id)
-
-    # now we iterate over list of files
+    # files synced before are resolved through the manifest in zendesk.json,
+    # files added to the TOC since then are created without a lookup
     for f in html_files_for_zendesk:
-        logger.info(f"Processing: {f}")
-        article_dict = md.update_article_dict(f["html_file_path"], s3, aws_s3_bucket)
-
-        section_id = f["section_id"]
-        # article exists on zendesk
-        # if article with same title and section_id is found
-        # then article exists
-        logger.info("Checking to see if article exists")
-        article_info = md.article_exists(
-            articles=zendesk_json_pre,
-            title=article_dict["article"]["title"],
-            section_id=section_id,
+        known = md.file_exists_on_zendesk(f, zendesk_state)
+        if known != md.NOT_FOUND and "article_id" in known:
+            for key in [
+                "article_id",
+                "article_html_url",
+                "digest",
+                "synced_at",
+                "source_digest",
+                "synced_state",
+            ]:
+                if key in known:
+                    f[key] = known[key]
+            if known.get("section_id") != f["section_id"]:
+                # moved to another part of the TOC, the 2nd pass moves it
+                f.pop("digest", None)
+                f.pop("source_digest", None)
+
+    # without a manifest, articles already in the category are adopted
+    # by title and section instead of being created a second time
+    zendesk_json_pre = {"articles": []}
+    if not zendesk_state["files"]:
+        zendesk_json_pre = md.list_remote_articles(hc, category_id)
+    articles_by_title = md.index_articles_by_title(zendesk_json_pre)
+
+    # with --incremental, pages whose sources did not change since they were
+    # last synced are left out, unless new articles could change their links
+    source_digests = {}
+    files_to_sync = html_files_for_zendesk
+    if ctx.obj.get("incremental"):
+        fingerprints = md.source_fingerprints(ctx.obj["source_dir"])
+        options = [
+            ctx.obj["draft"],
+            ctx.obj["public"],
+            ctx.obj.get("content_addressed_images", False),
+            image_backend.name,
+            # parsers can clean up malformed html differently
+            ctx.obj.get("html_parser") or md.HTML_PARSER,
+        ]
+        for f in html_files_for_zendesk:
+            if fingerprints["files"].get(f["toc_file"]) is not None:
+                source_digests[f["toc_file"]] = md.sync_fingerprint(
+                    fingerprints, f["toc_file"], options
+                )
+        if all("digest" in f for f in html_files_for_zendesk):
+            files_to_sync = [
+                f
+                for f in html_files_for_zendesk
+                if source_digests.get(f["toc_file"]) is None
+                or source_digests[f["toc_file"]] != f.get("source_digest")
+            ]
+        logger.info(
+            f"{len(files_to_sync)} of {len(html_files_for_zendesk)} pages changed"
         )
-        logger.info(f"Article Exists: {cpprint(article_info)}")
-
-        if ctx.obj["public"]:
-            article_dict["article"]["user_segment_id"] = None
-
-        if not article_info:
-            logger.info("Creating the article")
-            response_json = hc.create_article(section_id, json.dumps(article_dict))
-            article_id = response_json["article"]["id"]
-            f.update({"article_id": article_id})
-            article_html_url = response_json["article"]["html_url"]
-            f.update({"article_html_url": article_html_url})
-            md.logger.info(f"Article ID: {article_id}, Article URL: {article_html_url}")
-        else:  # update_article
-            logger.info("Updating the article")
-            article_id = article_info["id"]
-            article_html_url = article_info["html_url"]
-            translation_dict = {
-                "article": {
-                    "user_segment_id": article_dict["article"]["user_segment_id"]
-                },
-                "translation": {
-                    "title": article_dict["article"]["title"],
-                    "body": article_dict["article"]["body"],
-                },
-            }
-            response_json = hc.update_article_metadata(
-                article_id=article_id,
-                data=json.dumps(article_dict["article"]),
-                locale="en-us",
+
+    # every html file is parsed once, both passes work from these
+    pages = {}
+    try:
+        for f in files_to_sync:
+            pages[f["html_file_path"]] = md.parse_article_html(
+                f["html_file_path"], ctx.obj.get("html_parser")
             )
-            f.update({"article_id": article_id})
-            f.update({"article_html_url": article_html_url})
+    except Exception as e:
+        logger.warn("Error reading the html files of the book")
+        logger.exception(e)
+        exit(1)
 
-    # 2nd pass to fix URLs
-    for f in html_files_for_zendesk:
-        logging.info(f"Processing (2nd Pass): {f}")
-        article_dict = md.update_urls_in_article_dict(
-            f["html_file_path"],
-            html_files_for_zendesk,
+    # images of the whole book go up before any article body is rendered,
+    # zendesk attachments of articles that are not synced anymore go up again
+    image_backend.forget_missing_articles(
+        {f["article_id"] for f in html_files_for_zendesk if "article_id" in f}
+    )
+    md.upload_book_images(
+        pages.values(),
+        image_backend,
+        workers=ctx.obj.get("image_workers", 1),
+        skip_unchanged=ctx.obj.get("skip_unchanged_images", False),
+    )
+
+    # articles not created yet are linked to through placeholders, a new
+    # article without such links is created with its final body right away
+    article_urls = md.index_article_urls(html_files_for_zendesk)
+
+    def first_pass(f):
+        page = pages[f["html_file_path"]]
+        return sync_article_first_pass(
+            hc,
+            f,
+            page,
+            articles_by_title,
+            article_urls,
+            ctx.obj["draft"],
+            ctx.obj["public"],
+        )
+
+    def second_pass(f):
+        page = pages[f["html_file_path"]]
+        sync_article_second_pass(
+            hc, f, page, article_urls, ctx.obj["draft"], ctx.obj["public"]
         )
+        # only recorded once the article is on zendesk
+        if f["toc_file"] in source_digests:
+            f["source_digest"] = source_digests[f["toc_file"]]
+        else:
+            f.pop("source_digest", None)
+        return f
 
-        draft = ctx.obj["draft"]
-        article_dict["article"]["draft"] = draft
+    # only new articles are sent in the first pass
+    new_files = [f for f in files_to_sync if "article_id" not in f]
+    try:
+        try:
+            md.map_with_workers(first_pass, new_files, workers=workers)
+        except Exception as e:
+            logger.warn("Error creating or updating articles on Zendesk")
+            logger.exception(e)
+            exit(1)
+
+        stubs = sum(1 for f in new_files if "digest" not in f)
+        logger.info(f"Created {len(new_files)} articles, {stubs} of them as stubs")
 
-        if ctx.obj["public"]:
-            article_dict["article"]["user_segment_id"] = None
+        # zendesk attachments go to their article once it exists
+        image_backend.associate(
+            html_files_for_zendesk, workers=ctx.obj.get("image_workers", 1)
+        )
 
-        translation_dict = {
-            "translation": {
-                "title": article_dict["article"]["title"],
-                "body": article_dict["article"]["body"],
-                "draft": article_dict["article"]["draft"],
-            }
-        }
-        logging.info("Syncing the jupyterbook to zendesk...")
+        # 2nd pass sends the final bodies of the stubs and the changed articles
+        article_urls = md.index_article_urls(html_files_for_zendesk)
+        try:
+            md.map_with_workers(second_pass, files_to_sync, workers=workers)
+        except Exception as e:
+            logger.warn("Error fixing the article URLs on Zendesk")
+            logger.exception(e)
+            exit(1)
+    finally:
+        # keeps the ids of the articles created so far, also when the sync
+        # fails or is interrupted
+        md.write_zendesk_json(
+            zendesk_file_path, html_files_for_zendesk, category_name, category_id
+        )
+    logger.info(f"Zendesk API retries: {hc.retry_stats}")
+
+    # add the rest of the sync commands here
+    return 0
+
+
+def render_final_article(page, f, article_urls, draft, public):
+    """The article dict of a page as it should end up on zendesk"""
+    article_dict = md.update_urls_in_article_dict(page, article_urls)
+    article_dict["article"]["draft"] = draft
+    article_dict["article"]["section_id"] = f["section_id"]
+    if public:
+        article_dict["article"]["user_segment_id"] = None
+    return article_dict
+
+
+def sync_article_first_pass(
+    hc, f, page, articles_by_title, article_urls, draft, public
+):
+    """Create a single new article, records its id and url on f.
+
+    An article linking to other new articles is created as a stub, a draft
+    without its body, for the 2nd pass to send the body once all the urls
+    are known. Any other article is created with its final body and left
+    alone by the 2nd pass.
+    """
+    logger.info(f"Processing: {f}")
+    section_id = f["section_id"]
+    # article exists on zendesk
+    # if article with same title and section_id is found
+    # then article exists
+    logger.info("Checking to see if article exists")
+    article_info = md.article_exists(
+        articles_by_title=articles_by_title,
+        title=page["title"],
+        section_id=section_id,
+    )
+    logger.info(f"Article Exists: {cpprint(article_info)}")
+
+    if article_info:  # adopt the article, the 2nd pass sends all of it
+        logger.info("Adopting the article")
+        f.update({"article_id": article_info["id"]})
+        f.update({"article_html_url": article_info["html_url"]})
+        f.pop("synced_state", None)
+        return f
+
+    article_dict = render_final_article(page, f, article_urls, draft, public)
+    final = not md.has_placeholder_links(article_dict)
+    if final:
+        logger.info("Creating the article")
+    else:
+        logger.info("Creating the article as a stub")
+        article_dict["article"]["body"] = md.STUB_ARTICLE_BODY
+        article_dict["article"]["draft"] = True
+    response_json = hc.create_article(section_id, json.dumps(article_dict))
+    article_id = response_json["article"]["id"]
+    f.update({"article_id": article_id})
+    article_html_url = response_json["article"]["html_url"]
+    f.update({"article_html_url": article_html_url})
+    # the 2nd pass only sends what differs from this
+    f["synced_state"] = md.article_state(article_dict["article"])
+    if final:
+        f["digest"] = md.article_digest(article_dict)
+        f["synced_at"] = datetime.utcnow().strftime(md.ZENDESK_TIMESTAMP_FORMAT)
+    md.logger.info(f"Article ID: {article_id}, Article URL: {article_html_url}")
+    return f
+
+
+def check_response(response_json, key, f):
+    # a 4xx or 5xx comes back as None or as the error body, nothing of the
+    # update may be recorded in zendesk.json then
+    if not isinstance(response_json, dict) or key not in response_json:
+        raise ZendeskError(
+            f"Updating article {f['article_id']} of {f['toc_file']} failed: "
+            f"{response_json}"
+        )
+
+
+def sync_article_second_pass(hc, f, page, article_urls, draft, public):
+    """Rewrite the links of a single article and push its final body"""
+    logging.info(f"Processing (2nd Pass): {f}")
+    article_dict = render_final_article(page, f, article_urls, draft, public)
+
+    digest = md.article_digest(article_dict)
+    if f.get("digest") == digest:
+        logger.info(f"Unchanged since the last sync: {f['html_file_path']}")
+        return f
+
+    # only the fields that changed since the last sync go out, a body fix is
+    # a single translation PUT and a label change a small metadata PUT
+    metadata, translation = md.plan_article_update(
+        article_dict["article"], f.get("synced_state")
+    )
+    logging.info("Syncing the jupyterbook to zendesk...")
+    if metadata:
+        logging.info(f"Updating article metadata: {sorted(metadata)}")
         response_json = hc.update_article_metadata(
-            article_id=article_id,
-            data=json.dumps(article_dict["article"]),
+            article_id=f["article_id"],
+            data=json.dumps({"article": metadata}),
             locale="en-us",
         )
-        logging.info("Updating article visibility")
+        check_response(response_json, "article", f)
         logging.debug(cpprint(response_json))
-
+    if translation:
+        logging.info(f"Updating article translation: {sorted(translation)}")
         response_json = hc.update_article_translation(
-            f["article_id"], json.dumps(translation_dict), locale="en-us"
+            f["article_id"], json.dumps({"translation": translation}), locale="en-us"
         )
+        check_response(response_json, "translation", f)
         # get useful output
-        del response_json["translation"]["body"]
+        response_json["translation"].pop("body", None)
         logging.debug(cpprint(response_json))
-
-    # add the rest of the sync commands here
-    return 0
+    f["synced_state"] = md.article_state(article_dict["article"])
+    f["digest"] = digest
+    f["synced_at"] = datetime.utcnow().strftime(md.ZENDESK_TIMESTAMP_FORMAT)
+    return f
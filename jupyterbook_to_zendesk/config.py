@@ -0,0 +1,16 @@
+"""The settings of config.cfg, see Environment Variables in the README."""
+import configparser
+
+
+class Config:
+    """The [DEFAULT] section of config.cfg, without a file there are no settings"""
+
+    def __init__(self, config_file=None):
+        # no interpolation, tokens and secrets may contain %
+        self.parser = configparser.ConfigParser(interpolation=None)
+        if config_file:
+            self.parser.read(config_file)
+
+    def get(self, key):
+        # None for the settings config.cfg does not have
+        return self.parser.defaults().get(key)
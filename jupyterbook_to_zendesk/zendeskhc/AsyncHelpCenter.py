@@ -0,0 +1,208 @@
+import asyncio
+import base64
+import time
+
+try:  # only the async client needs aiohttp
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from jupyterbook_to_zendesk.zendeskhc.HelpCenter import HelpCenter
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import PageIterator
+
+
+class AsyncResponse:
+    """The parts of an aiohttp response Base needs, read before it is released"""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+class AsyncPageIterator(PageIterator):
+    """PageIterator for AsyncHelpCenter, used with async for and await"""
+
+    async def _get_page(self, url):
+        return self._check(
+            await self.client.get(url, self.client.email, self.client.password)
+        )
+
+    async def pages(self):
+        next_page_url = self.url
+        while next_page_url is not None:
+            data = await self._get_page(next_page_url)
+            yield data
+            urls = self.remaining_page_urls(data)
+            if urls is not None:
+                semaphore = asyncio.Semaphore(self.prefetch_workers)
+
+                async def get_page(url):
+                    async with semaphore:
+                        return await self._get_page(url)
+
+                for page in await asyncio.gather(*[get_page(url) for url in urls]):
+                    yield page
+                return
+            next_page_url = self.next_url(data)
+
+    def __iter__(self):
+        raise TypeError("use async for with AsyncHelpCenter iterators")
+
+    async def __aiter__(self):
+        async for page in self.pages():
+            for record in page[self.combine_key]:
+                yield record
+
+    async def collect(self):
+        data = None
+        async for page in self.pages():
+            if data is None:
+                data = page
+            else:
+                data[self.combine_key].extend(page[self.combine_key])
+        self.mark_complete(data)
+        return data
+
+
+class AsyncHelpCenter(HelpCenter):
+    """HelpCenter on a connection pooled aiohttp session.
+
+    Every HelpCenter method returns an awaitable here, so hundreds of
+    requests can be in flight from one process. Retries, their counters and
+    the rate limit budget are shared with the synchronous client.
+
+        async with AsyncHelpCenter(url, username, token) as hc:
+            responses = await asyncio.gather(
+                *[hc.show_article(article_id) for article_id in article_ids]
+            )
+    """
+
+    page_iterator_class = AsyncPageIterator
+
+    def __init__(
+        self,
+        domain,
+        email=None,
+        password=None,
+        requests_per_minute=None,
+        connections=100,
+    ):
+        if aiohttp is None:
+            raise ImportError("AsyncHelpCenter needs aiohttp: pip install aiohttp")
+        super().__init__(domain, email, password, requests_per_minute)
+        self.connections = connections
+        self._client_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_client_session(self):
+        if self._client_session is None or self._client_session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections)
+            self._client_session = aiohttp.ClientSession(connector=connector)
+        return self._client_session
+
+    async def close(self):
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
+
+    def _nothing_sent(self, error):
+        # the connection could not be opened, so no part of the request went out
+        connect_errors = (aiohttp.ClientConnectorError,)
+        if hasattr(aiohttp, "ConnectionTimeoutError"):  # aiohttp 3.10 and up
+            connect_errors += (aiohttp.ConnectionTimeoutError,)
+        return isinstance(error, connect_errors)
+
+    def _form_data(self, data, files):
+        # aiohttp consumes a form when sending it, every attempt gets its own
+        form = aiohttp.FormData()
+        for name, value in (data or {}).items():
+            form.add_field(name, value)
+        for name, (file_name, content, content_type) in files.items():
+            form.add_field(name, content, filename=file_name, content_type=content_type)
+        return form
+
+    async def _request(
+        self, method, url, data=None, email=None, password=None, files=None
+    ):
+        # same retry policy as Base._request, sleeping without blocking the loop
+        headers = {}
+        if data is not None and files is None:
+            headers["Content-Type"] = "application/json"
+        if email:
+            credentials = f"{email}:{password or ''}".encode("utf-8")
+            headers["Authorization"] = "Basic " + base64.b64encode(credentials).decode()
+        session = self._get_client_session()
+        connect_timeout, read_timeout = self.timeout
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        deadline = time.monotonic() + self.max_retry_seconds
+        attempt = 0
+        while True:
+            self.retry_stats.record_sleep(await self.rate_limit.wait_async())
+            response_raw, error = None, None
+            body = data if files is None else self._form_data(data, files)
+            try:
+                async with session.request(
+                    method, url, data=body, headers=headers, timeout=timeout
+                ) as response:
+                    content = await response.read()
+                    response_raw = AsyncResponse(
+                        response.status, response.headers, content
+                    )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            else:
+                self.rate_limit.update(response_raw.headers)
+
+            status_code = response_raw.status_code if response_raw is not None else None
+            response_headers = response_raw.headers if response_raw is not None else {}
+            delay = self._retry_delay(
+                method, status_code, response_headers, error, attempt
+            )
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response_raw
+
+            attempt += 1
+            if attempt > self.max_retries or time.monotonic() + delay > deadline:
+                if error is not None:
+                    raise error
+                return response_raw
+
+            self.retry_stats.record_retry()
+            if status_code == 429:
+                self.rate_limit.pause(delay)
+            else:
+                self.retry_stats.record_sleep(delay)
+                await asyncio.sleep(delay)
+
+    async def get(self, url, email=None, password=None):
+        response_raw = await self._request("GET", url, email=email, password=password)
+        return self._json_or_none(response_raw)
+
+    async def put(self, url, data, email=None, password=None):
+        response_raw = await self._request("PUT", url, data, email, password)
+        return self._json_or_none(response_raw)
+
+    async def post(self, url, data, email=None, password=None, files=None):
+        response_raw = await self._request("POST", url, data, email, password, files)
+        return self._json_or_none(response_raw)
+
+    async def delete(self, url, email=None, password=None):
+        response_raw = await self._request(
+            "DELETE", url, email=email, password=password
+        )
+        if response_raw.status_code == 204:  # HTTP Status for No Content
+            return {"status_code": 204}
+        elif response_raw.status_code == 404:  # HTTP Status for Not Found
+            return {"status_code": 404}
+        else:
+            return self._json_or_none(response_raw)
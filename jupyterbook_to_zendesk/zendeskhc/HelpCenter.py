@@ -11,34 +11,44 @@ from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import *
 
 
 class HelpCenter(Base):
-    def __init__(self, domain, email=None, password=None):
+    def __init__(self, domain, email=None, password=None, requests_per_minute=None):
         self.domain = domain
         self.email = email
         self.password = password
+        # the budget is shared by every HelpCenter of the process
+        if requests_per_minute:
+            self.rate_limit.configure(requests_per_minute)
 
-    def _page_gets(self, url, combine_key):
-        data = self.get(url, self.email, self.password)
-
-        if "error" in data.keys():
-            raise ZendeskError(data["error"])
+    page_iterator_class = PageIterator
+    cursor_pagination = True
+    # above 1, offset pagination is used and the pages after the first are
+    # fetched by this many workers at once
+    page_prefetch_workers = 0
 
-        next_page_url = data["next_page"]
-
-        while next_page_url is not None:
-            next_page_json = self.get(next_page_url, self.email, self.password)
-            data[combine_key] = data[combine_key] + next_page_json[combine_key]
-            next_page_url = next_page_json["next_page"]
+    def _page_iter(self, url, combine_key):
+        return self.page_iterator_class(
+            self, url, combine_key, self.page_prefetch_workers
+        )
 
-        data["next_page"] = None
-        return data
+    def _page_gets(self, url, combine_key):
+        return self._page_iter(url, combine_key).collect()
 
-    def _generate_options(self, options=None):
+    def _generate_options(self, options=None, cursor=False):
+        # cursor pagination (page[size]) on the endpoints that support it,
+        # unless offset pagination is asked for with page or per_page
         option_string = "?"
 
-        if not options:
-            options = {}
-
-        if "per_page" not in options.keys():
+        options = dict(options or {})
+
+        if (
+            cursor
+            and self.cursor_pagination
+            and self.page_prefetch_workers <= 1
+            and "page" not in options.keys()
+            and "per_page" not in options.keys()
+        ):
+            options.setdefault("page[size]", 100)
+        elif "per_page" not in options.keys():
             options["per_page"] = 100
 
         for i in options.keys():
@@ -51,55 +61,59 @@ class HelpCenter(Base):
 
     # Article functions
 
-    def list_all_articles(self, options=None):
-        option_string = self._generate_options(options)
+    def iter_all_articles(self, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = self.domain + "/api/v2/help_center/articles.json" + option_string
-        return self._page_gets(url, "articles")
+        return self._page_iter(url, "articles")
 
-    def list_articles_by_locale(self, locale, options=None):
-        option_string = self._generate_options(options)
+    def list_all_articles(self, options=None):
+        return self.iter_all_articles(options).collect()
+
+    def iter_articles_by_locale(self, locale, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = self.domain + "/api/v2/help_center/{locale}/articles.json" + option_string
         url = url.format(locale=locale)
-        return self._page_gets(url, "articles")
+        return self._page_iter(url, "articles")
 
-    def list_articles_by_category(self, category_id, options=None):
-        option_string = self._generate_options(options)
+    def list_articles_by_locale(self, locale, options=None):
+        return self.iter_articles_by_locale(locale, options).collect()
+
+    def iter_articles_by_category(self, category_id, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = (
             self.domain
             + "/api/v2/help_center/categories/{id}/articles.json"
             + option_string
         )
         url = url.format(id=category_id)
-        return self._page_gets(url, "articles")
+        return self._page_iter(url, "articles")
 
-    def list_articles_by_section(self, section_id, options=None):
-        option_string = self._generate_options(options)
+    def list_articles_by_category(self, category_id, options=None):
+        return self.iter_articles_by_category(category_id, options).collect()
+
+    def iter_articles_by_section(self, section_id, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = (
             self.domain
             + "/api/v2/help_center/sections/{id}/articles.json"
             + option_string
         )
         url = url.format(id=section_id)
-        return self._page_gets(url, "articles")
+        return self._page_iter(url, "articles")
 
-    def list_articles_by_user(self, user_id, options=None):
-        option_string = self._generate_options(options)
+    def list_articles_by_section(self, section_id, options=None):
+        return self.iter_articles_by_section(section_id, options).collect()
+
+    def iter_articles_by_user(self, user_id, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = (
             self.domain + "/api/v2/help_center/users/{id}/articles.json" + option_string
         )
         url = url.format(id=user_id)
-        return self._page_gets(url, "articles")
+        return self._page_iter(url, "articles")
 
-    def list_changed_articles(self, start_time, options=None):
-        # start_time should be a Unix epoch time
-        option_string = self._generate_options(options)
-        url = (
-            self.domain
-            + "/api/v2/help_center/incremental/articles.json?start_time={start_time}"
-            + option_string
-        )
-        url = url.format(start_time=start_time)
-        return self._page_gets(url, "articles")
+    def list_articles_by_user(self, user_id, options=None):
+        return self.iter_articles_by_user(user_id, options).collect()
 
     def show_article(self, article_id, locale=None):
         if not locale:
@@ -291,26 +305,35 @@ class HelpCenter(Base):
 
     # Section functions
 
-    def list_all_sections(self, options=None):
-        option_string = self._generate_options(options)
+    def iter_all_sections(self, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = self.domain + "/api/v2/help_center/sections.json" + option_string
-        return self._page_gets(url, "sections")
+        return self._page_iter(url, "sections")
 
-    def list_sections_by_locale(self, locale, options=None):
-        option_string = self._generate_options(options)
+    def list_all_sections(self, options=None):
+        return self.iter_all_sections(options).collect()
+
+    def iter_sections_by_locale(self, locale, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = self.domain + "/api/v2/help_center/{locale}/sections.json" + option_string
         url = url.format(locale=locale)
-        return self._page_gets(url, "sections")
+        return self._page_iter(url, "sections")
 
-    def list_sections_by_category(self, category_id, options=None):
-        option_string = self._generate_options(options)
+    def list_sections_by_locale(self, locale, options=None):
+        return self.iter_sections_by_locale(locale, options).collect()
+
+    def iter_sections_by_category(self, category_id, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = (
             self.domain
             + "/api/v2/help_center/categories/{category_id}/sections.json"
             + option_string
         )
         url = url.format(category_id=category_id)
-        return self._page_gets(url, "sections")
+        return self._page_iter(url, "sections")
+
+    def list_sections_by_category(self, category_id, options=None):
+        return self.iter_sections_by_category(category_id, options).collect()
 
     def show_section(self, section_id, locale=None):
         if not locale:
@@ -376,18 +399,24 @@ class HelpCenter(Base):
 
     # Category functions
 
-    def list_all_categories(self, options=None):
-        option_string = self._generate_options(options)
+    def iter_all_categories(self, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = self.domain + "/api/v2/help_center/categories.json" + option_string
-        return self._page_gets(url, "categories")
+        return self._page_iter(url, "categories")
 
-    def list_categories_by_locale(self, locale, options=None):
-        option_string = self._generate_options(options)
+    def list_all_categories(self, options=None):
+        return self.iter_all_categories(options).collect()
+
+    def iter_categories_by_locale(self, locale, options=None):
+        option_string = self._generate_options(options, cursor=True)
         url = (
             self.domain + "/api/v2/help_center/{locale}/categories.json" + option_string
         )
         url = url.format(locale=locale)
-        return self._page_gets(url, "categories")
+        return self._page_iter(url, "categories")
+
+    def list_categories_by_locale(self, locale, options=None):
+        return self.iter_categories_by_locale(locale, options).collect()
 
     def show_category(self, category_id, locale=None):
         if not locale:
@@ -573,17 +602,28 @@ class HelpCenter(Base):
         )
         return self.get(url, self.email, self.password)
 
-    def create_article_attachment(self, article_id, data):
+    def create_article_attachment(self, article_id, data, files=None):
+        # files: {"file": (file_name, content, content_type)}, data: {"inline": "true"}
         url = (
             self.domain
             + "/api/v2/help_center/articles/{article_id}/attachments.json".format(
                 article_id=article_id
             )
         )
-        return self.post(url, data, self.email, self.password)
+        return self.post(url, data, self.email, self.password, files=files)
 
-    def create_unassociated_attachment(self, data):
+    def create_unassociated_attachment(self, data, files=None):
         url = self.domain + "/api/v2/help_center/articles/attachments.json"
+        return self.post(url, data, self.email, self.password, files=files)
+
+    def associate_article_attachments(self, article_id, data):
+        # data: {"attachment_ids": [...]}, at most 20 per request
+        url = (
+            self.domain
+            + "/api/v2/help_center/articles/{article_id}/bulk_attachments.json".format(
+                article_id=article_id
+            )
+        )
         return self.post(url, data, self.email, self.password)
 
     def delete_article_attachment(self, attachment_id, data):
@@ -1,8 +1,19 @@
+import asyncio
 import json
-import sys
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
 
 import requests
+import urllib3
 
 
 class ZendeskError(Exception):
@@ -10,77 +21,387 @@ class ZendeskError(Exception):
         self.value = value
 
     def __str__(self):
-        return sys.repr(self.value)
+        return repr(self.value)
+
+
+class RateLimitBudget:
+    """Request budget shared by every thread talking to the same Zendesk.
+
+    A token bucket refilled at requests_per_minute keeps parallel workers at
+    the plan quota instead of running into 429s. The limit and remaining
+    count Zendesk sends back with every response tighten it further. When a
+    request is still answered with a 429 the whole budget is paused for the
+    Retry-After period, so all workers stop together.
+    """
+
+    def __init__(self, requests_per_minute=None):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+        self._configured_rpm = None
+        self.requests_per_minute = None  # None is no limit until zendesk sends one
+        self._tokens = 0.0
+        self._refilled_at = time.monotonic()
+        if requests_per_minute:
+            self.configure(requests_per_minute)
+
+    def _capacity(self):
+        # a second worth of requests, enough to keep the workers busy
+        # without bursting through the quota
+        return max(1.0, self.requests_per_minute / 60)
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._tokens = min(
+            self._capacity(), self._tokens + elapsed * self.requests_per_minute / 60
+        )
+
+    def _set_rate(self, requests_per_minute):
+        now = time.monotonic()
+        if self.requests_per_minute is None:
+            self._refilled_at = now
+            self.requests_per_minute = requests_per_minute
+            self._tokens = self._capacity()
+        else:
+            self._refill(now)
+            self.requests_per_minute = requests_per_minute
+            self._tokens = min(self._tokens, self._capacity())
+
+    def configure(self, requests_per_minute):
+        with self._lock:
+            self._configured_rpm = float(requests_per_minute)
+            self._set_rate(self._configured_rpm)
+
+    def update(self, headers):
+        # X-Rate-Limit is the plan quota per minute, X-Rate-Limit-Remaining
+        # what is left of it right now (ratelimit-* on the newer endpoints)
+        limit = headers.get("X-Rate-Limit", headers.get("ratelimit-limit"))
+        remaining = headers.get(
+            "X-Rate-Limit-Remaining", headers.get("ratelimit-remaining")
+        )
+        with self._lock:
+            try:
+                limit = float(limit) if limit is not None else None
+                remaining = float(remaining) if remaining is not None else None
+            except ValueError:
+                return
+            if limit and (self._configured_rpm is None or limit < self._configured_rpm):
+                if limit != self.requests_per_minute:
+                    self._set_rate(limit)
+            if remaining is not None and self.requests_per_minute:
+                self._refill(time.monotonic())
+                self._tokens = min(self._tokens, remaining)
+
+    def _reserve(self):
+        # take a token, or return how long to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            delay = self._resume_at - now
+            if delay > 0:
+                return delay
+            if self.requests_per_minute is None:
+                return 0.0
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) * 60 / self.requests_per_minute
+
+    def wait(self):
+        slept = 0.0
+        delay = self._reserve()
+        while delay > 0:
+            time.sleep(delay)
+            slept += delay
+            delay = self._reserve()
+        return slept
+
+    async def wait_async(self):
+        slept = 0.0
+        delay = self._reserve()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            slept += delay
+            delay = self._reserve()
+        return slept
+
+    def pause(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+class RetryStats:
+    """Retries and time spent sleeping on them, for the whole run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.sleep_seconds = 0.0
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_sleep(self, sleep_seconds):
+        with self._lock:
+            self.sleep_seconds += sleep_seconds
+
+    def reset(self):
+        with self._lock:
+            self.retries = 0
+            self.sleep_seconds = 0.0
+
+    def __str__(self):
+        return f"{self.retries} retries, {self.sleep_seconds:.1f}s sleeping"
+
+
+def parse_retry_after(value, default=1.0):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class PageIterator:
+    """Records of a paginated list endpoint, fetched one page at a time.
+
+    Iterating yields the records and only keeps the current page in memory,
+    collect() returns all of them in the response layout of the first page.
+
+    With prefetch_workers above 1 and an offset paginated endpoint, the
+    pages after the first are requested together once page_count is known
+    and are still yielded in order.
+    """
+
+    def __init__(self, client, url, combine_key, prefetch_workers=0):
+        self.client = client
+        self.url = url
+        self.combine_key = combine_key
+        self.prefetch_workers = prefetch_workers
+
+    def _check(self, data):
+        if data is None:
+            raise ZendeskError(f"No JSON response for {self.url}")
+        if "error" in data.keys():
+            raise ZendeskError(data["error"])
+        return data
+
+    @staticmethod
+    def next_url(data):
+        # offset pages link the next one in next_page, cursor pages in
+        # links.next, which is only followed while meta.has_more is set
+        if "meta" in data.keys() and "links" in data.keys():
+            if data["meta"].get("has_more"):
+                return data["links"].get("next")
+            return None
+        return data.get("next_page")
+
+    def remaining_page_urls(self, data):
+        # urls of the pages after this one when all of them can be known up
+        # front, None when they have to be followed one link at a time
+        next_page_url = data.get("next_page")
+        if self.prefetch_workers <= 1 or next_page_url is None:
+            return None
+        page_count = data.get("page_count")
+        if page_count is None and data.get("count") and data.get("per_page"):
+            page_count = -(-data["count"] // data["per_page"])
+        scheme, netloc, path, query, fragment = urlsplit(next_page_url)
+        params = dict(parse_qsl(query))
+        if not page_count or "page" not in params:
+            return None
+        urls = []
+        for page in range(int(params["page"]), page_count + 1):
+            params["page"] = str(page)
+            urls.append(urlunsplit((scheme, netloc, path, urlencode(params), fragment)))
+        return urls
+
+    def _get_page(self, url):
+        return self._check(
+            self.client.get(url, self.client.email, self.client.password)
+        )
+
+    def pages(self):
+        next_page_url = self.url
+        while next_page_url is not None:
+            data = self._get_page(next_page_url)
+            yield data
+            urls = self.remaining_page_urls(data)
+            if urls is not None:
+                with ThreadPoolExecutor(self.prefetch_workers) as executor:
+                    yield from executor.map(self._get_page, urls)
+                return
+            next_page_url = self.next_url(data)
+
+    def __iter__(self):
+        for page in self.pages():
+            yield from page[self.combine_key]
+
+    def collect(self):
+        data = None
+        for page in self.pages():
+            if data is None:
+                data = page
+            else:
+                data[self.combine_key].extend(page[self.combine_key])
+        self.mark_complete(data)
+        return data
+
+    @staticmethod
+    def mark_complete(data):
+        data["next_page"] = None
+        if "meta" in data.keys() and "links" in data.keys():
+            data["meta"]["has_more"] = False
+            data["links"]["next"] = None
 
 
 class Base:
     session = requests.Session()
+    rate_limit = RateLimitBudget()
+    retry_stats = RetryStats()
+
+    # retry policy for 429, 5xx and connection errors
+    max_retries = 8
+    max_retry_seconds = 300
+    backoff_base = 1.0
+    backoff_cap = 60.0
+    # zendesk may have saved a POST before a 5xx or a dropped connection,
+    # sending it again would create the record twice
+    idempotent_methods = ("GET", "HEAD", "PUT", "DELETE")
+    # seconds to connect and to wait for each read, without them a stalled
+    # connection hangs its worker for good
+    timeout = (10, 120)
 
     def __del__(self):
         self.session.close()
 
-    def get(self, url, email=None, password=None):
-        self.session.auth = (email, password)
-        response_raw = self.session.get(url)
+    def set_pool_size(self, size):
+        # requests keeps 10 connections per host by default, more workers
+        # than that would throw connections away after every call
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(size, 10))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-        if response_raw.status_code == 429:
-            time.sleep(response_raw.headers["Retry-After"])
-            return get(url, email, password)
-        else:
-            if response_raw.headers["Content-Type"].startswith(
-                "application/json"
-            ):  # sometimes, its UTF-8 instead of utf-8
-                response_json = json.loads(response_raw.content)
+    def _backoff_delay(self, attempt):
+        # exponential backoff with jitter, so workers that failed together
+        # do not all come back at the same moment
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
 
-                return response_json
+    def _nothing_sent(self, error):
+        # connect errors happen before any of the request went out
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        reason = getattr(reason, "reason", reason)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
 
-            else:
+    def _retry_delay(self, method, status_code, headers, error, attempt):
+        # how long to sleep before retrying, None when there is nothing to retry.
+        # A 429 was turned away unprocessed, anything else is only retried
+        # when sending the request again cannot do it twice
+        safe = method in self.idempotent_methods
+        if error is not None:
+            if safe or self._nothing_sent(error):
+                return self._backoff_delay(attempt)
+        elif status_code == 429:
+            return parse_retry_after(headers.get("Retry-After"))
+        elif status_code >= 500 and safe:
+            return self._backoff_delay(attempt)
+        return None
 
-                return None
+    def _request(self, method, url, data=None, email=None, password=None, files=None):
+        """Send a request, retrying 429, 5xx and connection errors.
 
-    def put(self, url, data, email=None, password=None):
-        self.session.auth = (email, password)
-        self.session.headers = {"Content-Type": "application/json"}
-        response_raw = self.session.put(url, data)
+        POST requests are only retried after a 429 or a failed connect, see
+        _retry_delay. Gives up after max_retries attempts or once the next
+        sleep would go past max_retry_seconds. The last response is then
+        returned as is, the last connection error is raised.
 
-        if response_raw.status_code == 429:
-            time.sleep(response_raw.headers["Retry-After"])
-            return self.put(url, data, email, password)
-        else:
-            if response_raw.headers["Content-Type"].startswith("application/json"):
-                response_json = json.loads(response_raw.content)
-                return response_json
+        files, {"file": (file_name, content, content_type)}, sends a
+        multipart form with data as its other fields instead of json.
+        """
+        headers = {}
+        if data is not None and files is None:
+            headers["Content-Type"] = "application/json"
+        deadline = time.monotonic() + self.max_retry_seconds
+        attempt = 0
+        while True:
+            self.retry_stats.record_sleep(self.rate_limit.wait())
+            response_raw, error = None, None
+            try:
+                response_raw = self.session.request(
+                    method,
+                    url,
+                    data=data,
+                    files=files,
+                    headers=headers,
+                    auth=(email, password),
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
             else:
-                return None
+                self.rate_limit.update(response_raw.headers)
 
-    def post(self, url, data, email=None, password=None):
-        self.session.auth = (email, password)
-        self.session.headers = {"Content-Type": "application/json"}
-        response_raw = self.session.post(url, data)
+            status_code = response_raw.status_code if response_raw is not None else None
+            response_headers = response_raw.headers if response_raw is not None else {}
+            delay = self._retry_delay(
+                method, status_code, response_headers, error, attempt
+            )
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response_raw
 
-        if response_raw.status_code == 429:
-            time.sleep(response_raw.headers["Retry-After"])
-            return post(url, data, email, password)
-        else:
-            if response_raw.headers["Content-Type"].startswith("application/json"):
-                response_json = json.loads(response_raw.content)
-                return response_json
+            attempt += 1
+            if attempt > self.max_retries or time.monotonic() + delay > deadline:
+                if error is not None:
+                    raise error
+                return response_raw
+
+            self.retry_stats.record_retry()
+            if status_code == 429:
+                # every worker waits this one out in rate_limit.wait above
+                self.rate_limit.pause(delay)
             else:
-                return None
+                self.retry_stats.record_sleep(delay)
+                time.sleep(delay)
+
+    def _json_or_none(self, response_raw):
+        # sometimes, its UTF-8 instead of utf-8
+        if response_raw.headers.get("Content-Type", "").lower().startswith(
+            "application/json"
+        ):
+            return json.loads(response_raw.content)
+        return None
+
+    def get(self, url, email=None, password=None):
+        response_raw = self._request("GET", url, email=email, password=password)
+        return self._json_or_none(response_raw)
+
+    def put(self, url, data, email=None, password=None):
+        response_raw = self._request("PUT", url, data, email, password)
+        return self._json_or_none(response_raw)
+
+    def post(self, url, data, email=None, password=None, files=None):
+        response_raw = self._request("POST", url, data, email, password, files)
+        return self._json_or_none(response_raw)
 
     def delete(self, url, email=None, password=None):
-        self.session.auth = (email, password)
-        response_raw = self.session.delete(url)
-        if response_raw.status_code == 429:
-            time.sleep(response_raw.headers["Retry-After"])
-            return self.delete(url, data, email, password)
-        elif response_raw.status_code == 204:  # HTTP Status for No Content
+        response_raw = self._request("DELETE", url, email=email, password=password)
+        if response_raw.status_code == 204:  # HTTP Status for No Content
             return {"status_code": 204}
         elif response_raw.status_code == 404:  # HTTP Status for Not Found
             return {"status_code": 404}
         else:
-            if response_raw.headers["Content-Type"].startswith("application/json"):
-                response_json = json.loads(response_raw.content)
-                return response_json
-            else:
-                return None
+            return self._json_or_none(response_raw)
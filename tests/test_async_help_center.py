@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""Tests for `AsyncHelpCenter` against a local stub Zendesk server."""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from jupyterbook_to_zendesk.zendeskhc.AsyncHelpCenter import AsyncHelpCenter
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import RateLimitBudget
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import RetryStats
+
+
+class StubZendesk(BaseHTTPRequestHandler):
+    """Answers the handful of Help Center endpoints the tests use"""
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(("GET", self.path))
+        if self.path.startswith("/api/v2/help_center/articles/"):
+            article_id = int(self.path.split("/")[-1].split(".")[0])
+            if article_id == 429 and not server.throttled:
+                server.throttled = True
+                return self.send_json(429, {}, {"Retry-After": "0"})
+            return self.send_json(200, {"article": {"id": article_id}})
+        if self.path.startswith("/api/v2/help_center/categories/1/articles.json"):
+            page = 2 if "page=2" in self.path else 1
+            next_page = None
+            if page == 1:
+                next_page = server.url + self.path.split("?")[0] + "?page=2"
+            articles = [{"id": page * 10 + i} for i in range(2)]
+            return self.send_json(
+                200,
+                {
+                    "articles": articles,
+                    "next_page": next_page,
+                    "page": page,
+                    "page_count": 2,
+                },
+            )
+        self.send_json(404, {"error": "RecordNotFound"})
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        self.server.requests.append(("POST", self.path))
+        body["article"]["id"] = 99
+        self.send_json(201, body)
+
+    def do_DELETE(self):
+        self.server.requests.append(("DELETE", self.path))
+        self.send_response(204)
+        self.end_headers()
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubZendesk)
+    server.requests = []
+    server.throttled = False
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def make_client(server):
+    hc = AsyncHelpCenter(server.url, "user@example.com/token", "secret")
+    hc.retry_stats = RetryStats()
+    hc.rate_limit = RateLimitBudget()
+    return hc
+
+
+def test_requests_overlap(stub_url):
+    async def run():
+        async with make_client(stub_url) as hc:
+            return await asyncio.gather(*[hc.show_article(i) for i in range(50)])
+
+    responses = asyncio.run(run())
+    assert [response["article"]["id"] for response in responses] == list(range(50))
+
+
+def test_pages_are_combined(stub_url):
+    async def run():
+        async with make_client(stub_url) as hc:
+            return await hc.list_articles_by_category(1)
+
+    data = asyncio.run(run())
+    assert [article["id"] for article in data["articles"]] == [10, 11, 20, 21]
+    assert data["next_page"] is None
+
+
+def test_pages_can_be_streamed(stub_url):
+    async def run():
+        async with make_client(stub_url) as hc:
+            return [
+                article["id"]
+                async for article in hc.iter_articles_by_category(1)
+            ]
+
+    assert asyncio.run(run()) == [10, 11, 20, 21]
+
+
+def test_pages_can_be_prefetched(stub_url):
+    async def run():
+        async with make_client(stub_url) as hc:
+            hc.page_prefetch_workers = 4
+            return await hc.list_articles_by_category(1)
+
+    data = asyncio.run(run())
+    assert [article["id"] for article in data["articles"]] == [10, 11, 20, 21]
+    assert "per_page=100" in stub_url.requests[0][1]
+
+
+def test_create_archive_and_retry(stub_url):
+    async def run():
+        async with make_client(stub_url) as hc:
+            created = await hc.create_article(5, json.dumps({"article": {}}))
+            archived = await hc.archive_article(99)
+            throttled = await hc.show_article(429)
+            return created, archived, throttled, hc.retry_stats.retries
+
+    created, archived, throttled, retries = asyncio.run(run())
+    assert created == {"article": {"id": 99}}
+    assert archived == {"status_code": 204}
+    assert throttled == {"article": {"id": 429}}
+    assert retries == 1
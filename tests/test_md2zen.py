@@ -0,0 +1,795 @@
+#!/usr/bin/env python
+"""Tests for `jupyterbook_to_zendesk.commands.md2zen`."""
+import hashlib
+import json
+import sys
+import threading
+import time
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+from jupyterbook_to_zendesk.commands import image_backends
+from jupyterbook_to_zendesk.commands import md2zen as md
+from jupyterbook_to_zendesk.commands import sync_to_zendesk
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import ZendeskError
+
+PAGE_HTML = """<html><head><title> Page A </title></head><body>
+<div id="main-content"><h1>A<a class="headerlink" href="#a">#</a></h1>
+<img src="_images/z.jpg"/><a href="b.html#part">B</a>
+<a href="https://example.com">Example</a>
+<div class="prev-next-area">next</div></div></body></html>"""
+
+
+@pytest.fixture
+def page_path(tmp_path):
+    html_file_path = tmp_path / "a.html"
+    html_file_path.write_text(PAGE_HTML)
+    return str(html_file_path)
+
+
+def test_map_with_workers_keeps_order():
+    def slow_square(n):
+        # later items finish first
+        time.sleep((10 - n) / 1000)
+        return n * n
+
+    assert md.map_with_workers(slow_square, range(10), workers=4) == [
+        n * n for n in range(10)
+    ]
+
+
+def test_map_with_workers_stops_on_first_error():
+    started = []
+    lock = threading.Lock()
+
+    def fail_on_two(n):
+        with lock:
+            started.append(n)
+        if n == 2:
+            raise ValueError("boom")
+        time.sleep(0.01)
+        return n
+
+    with pytest.raises(ValueError):
+        md.map_with_workers(fail_on_two, range(100), workers=2)
+    assert len(started) < 100
+
+
+def test_map_with_workers_cancels_on_interrupt():
+    started = []
+    lock = threading.Lock()
+
+    def interrupt_on_two(n):
+        with lock:
+            started.append(n)
+        if n == 2:
+            raise KeyboardInterrupt
+        time.sleep(0.01)
+        return n
+
+    with pytest.raises(KeyboardInterrupt):
+        md.map_with_workers(interrupt_on_two, range(100), workers=2)
+    assert len(started) < 100
+
+
+def test_load_config_reads_the_default_section(tmp_path):
+    config_file = tmp_path / "config.cfg"
+    config_file.write_text(
+        "[DEFAULT]\nurl = https://example.zendesk.com\ntoken = 50%off\n"
+        "jupyter_book_jobs =\n"
+    )
+    App = md.load_config(str(config_file))
+    assert App.get("url") == "https://example.zendesk.com"
+    assert App.get("token") == "50%off"
+    assert App.get("aws_s3_bucket") is None
+    assert md.get_config_option(App, "jupyter_book_jobs", "auto") == "auto"
+    assert md.get_config_option(md.load_config(None), "image_backend", "s3") == "s3"
+
+
+def test_article_digest_tracks_content():
+    article_dict = md.deepcopy(md.ARTICLE_DICT)
+    article_dict["article"]["title"] = "Title"
+    article_dict["article"]["body"] = "<p>Body</p>"
+    digest = md.article_digest(article_dict)
+
+    assert md.article_digest(md.deepcopy(article_dict)) == digest
+    article_dict["article"]["body"] = "<p>Body.</p>"
+    assert md.article_digest(article_dict) != digest
+
+
+def test_plan_article_update_sends_only_changed_fields():
+    article = dict(md.ARTICLE_DICT["article"], title="Title", body="<p>Body</p>")
+    article.update(section_id=1, label_names=["a"])
+    metadata, translation = md.plan_article_update(article)
+    assert set(metadata) == set(md.ARTICLE_METADATA_KEYS)
+    assert set(translation) == {"title", "body", "draft"}
+
+    synced_state = json.loads(json.dumps(md.article_state(article)))
+    assert synced_state["body"] != article["body"]
+    assert md.plan_article_update(article, synced_state) == ({}, {})
+
+    changed = dict(article, body="<p>Body.</p>")
+    assert md.plan_article_update(changed, synced_state) == (
+        {},
+        {"body": "<p>Body.</p>"},
+    )
+    changed = dict(article, label_names=["a", "b"], user_segment_id=None)
+    assert md.plan_article_update(changed, synced_state) == (
+        {"label_names": ["a", "b"], "user_segment_id": None},
+        {},
+    )
+    changed = dict(article, draft=False)
+    assert md.plan_article_update(changed, synced_state) == ({}, {"draft": False})
+
+
+class ForbiddenHelpCenter:
+    """Answers metadata updates with the error body of a 403"""
+
+    def __init__(self):
+        self.translations = []
+
+    def update_article_metadata(self, article_id, data, locale=None):
+        return {"error": "Forbidden"}
+
+    def update_article_translation(self, article_id, data, locale):
+        self.translations.append(article_id)
+        return {"translation": json.loads(data)["translation"]}
+
+
+def test_failed_metadata_update_is_not_recorded(page_path):
+    f = {
+        "toc_file": "a",
+        "html_file_path": page_path,
+        "article_id": 5,
+        "article_html_url": "https://zd/a",
+        "section_id": 1,
+    }
+    article_urls = md.index_article_urls([f])
+    page = md.parse_article_html(page_path)
+    article_dict = sync_to_zendesk.render_final_article(
+        page, f, article_urls, True, True
+    )
+    synced_state = md.article_state(
+        dict(article_dict["article"], label_names=["removed"])
+    )
+    f.update(digest="old", synced_state=synced_state)
+
+    with pytest.raises(ZendeskError):
+        sync_to_zendesk.sync_article_second_pass(
+            ForbiddenHelpCenter(), f, page, article_urls, True, True
+        )
+    assert f["digest"] == "old"
+    assert f["synced_state"] == synced_state
+    assert "synced_at" not in f
+
+
+def test_zendesk_json_round_trip(tmp_path):
+    zendesk_file_path = str(tmp_path / md.ZENDESK_FILE)
+    articles = [
+        {
+            "toc_file": "chapter/a",
+            "html_file_path": "/book/_build/html/chapter/a.html",
+            "article_id": 1,
+            "digest": "abc",
+        }
+    ]
+    md.write_zendesk_json(zendesk_file_path, articles)
+
+    zendesk_json = md.read_zendesk_json(zendesk_file_path)
+    assert zendesk_json["files"] == {
+        "chapter/a": {
+            "html_file_path": "/book/_build/html/chapter/a.html",
+            "article_id": 1,
+            "digest": "abc",
+        }
+    }
+    f = {"toc_file": "chapter/a", "html_file_path": "/elsewhere/a.html"}
+    assert md.file_exists_on_zendesk(f, zendesk_json)["article_id"] == 1
+    assert md.file_exists_on_zendesk({"toc_file": "b"}, zendesk_json) == md.NOT_FOUND
+
+
+def test_zendesk_json_with_an_article_list_is_read_as_manifest(tmp_path):
+    zendesk_file_path = tmp_path / md.ZENDESK_FILE
+    zendesk_file_path.write_text(
+        json.dumps(
+            {
+                "timestamp": "02-04-2021:09:12:56Z",
+                "articles": [
+                    {"html_file_path": "/book/_build/html/a.html", "article_id": 1}
+                ],
+            }
+        )
+    )
+    zendesk_json = md.read_zendesk_json(str(zendesk_file_path))
+    assert zendesk_json["files"]["a"]["article_id"] == 1
+
+
+def test_article_exists_matches_title_within_section():
+    articles_by_title = md.index_articles_by_title(
+        {
+            "articles": [
+                {"id": 1, "title": "Setup", "section_id": 10},
+                {"id": 2, "title": "Setup", "section_id": 20},
+            ]
+        }
+    )
+    assert md.article_exists(articles_by_title, "Setup", 20)["id"] == 2
+    assert not md.article_exists(articles_by_title, "Setup", 30)
+
+
+def test_parse_article_html_collects_local_tags(page_path):
+    page = md.parse_article_html(page_path)
+
+    assert page["title"] == "Page A"
+    assert [tag["src"] for tag in page["img_tags"]] == ["_images/z.jpg"]
+    assert [href for tag, href in page["a_tags"]] == ["b.html#part"]
+    assert "prev-next-area" not in str(page["main_content"])
+    assert "headerlink" not in str(page["main_content"])
+
+
+def test_update_urls_in_article_dict_uses_cached_page(page_path):
+    page = md.parse_article_html(page_path)
+    html_files_for_zendesk = [
+        {"html_file_path": "/book/b.html", "article_html_url": "https://zd/b"}
+    ]
+    with open(page_path, "w") as f:
+        f.write("")  # the 2nd pass must not read the file again
+
+    article_urls = md.index_article_urls(html_files_for_zendesk)
+    article_dict = md.update_urls_in_article_dict(page, article_urls)
+    assert 'href="https://zd/b#part"' in article_dict["article"]["body"]
+    assert 'href="https://example.com"' in article_dict["article"]["body"]
+
+
+def test_parsers_render_the_same_body(page_path):
+    default = md.render_article_dict(md.parse_article_html(page_path))
+    builtin = md.render_article_dict(md.parse_article_html(page_path, "html.parser"))
+    assert default["article"]["body"] == builtin["article"]["body"]
+
+
+def test_parsers_repair_malformed_pages_differently(tmp_path):
+    # an unclosed <p> and a stray </div>, lxml closes the first paragraph,
+    # html.parser nests the second one in it
+    pytest.importorskip("lxml")
+    html_file_path = tmp_path / "a.html"
+    html_file_path.write_text(
+        PAGE_HTML.replace(
+            '<img src="_images/z.jpg"/>',
+            "<p>First<p>Second</p></div><img src=\"_images/z.jpg\"/>",
+        )
+    )
+    lxml, builtin = [
+        md.render_article_dict(md.parse_article_html(str(html_file_path), parser))
+        for parser in ["lxml", "html.parser"]
+    ]
+    assert lxml["article"]["body"] != builtin["article"]["body"]
+    # so the article is sent again when the parser changes
+    assert md.article_digest(lxml) != md.article_digest(builtin)
+
+
+class RecordingS3:
+    def __init__(self, contents=None):
+        self.keys = []
+        self.contents = contents or []
+
+    def upload_file(self, local_file_path, bucket, s3_file_key, ExtraArgs=None):
+        self.keys.append(s3_file_key)
+        self.extra_args = ExtraArgs
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        return [{"Contents": self.contents}]
+
+
+def test_upload_book_images_uploads_each_image_once(tmp_path):
+    (tmp_path / "_images").mkdir()
+    (tmp_path / "_images" / "z.jpg").write_bytes(b"zzz")
+    (tmp_path / "_images" / "copy.jpg").write_bytes(b"zzz")
+    pages = []
+    for name, img in [("a", "z.jpg"), ("b", "z.jpg"), ("c", "copy.jpg")]:
+        html_file_path = tmp_path / f"{name}.html"
+        html_file_path.write_text(PAGE_HTML.replace("z.jpg", img))
+        pages.append(md.parse_article_html(str(html_file_path)))
+
+    s3 = RecordingS3()
+    backend = image_backends.S3ImageBackend(s3, "bucket")
+    stats = md.upload_book_images(pages, backend, workers=2)
+
+    assert s3.keys == ["z.jpg"]
+    assert stats["references"] == 3
+    assert stats["bytes_saved"] == 6
+    for page in pages:
+        assert page["img_tags"][0]["src"] == md.AWS_URL_PREFIX + "bucket/z.jpg"
+
+
+def test_failed_s3_upload_leaves_the_img_tags_alone(tmp_path, caplog):
+    class FailingS3(RecordingS3):
+        def upload_file(self, local_file_path, bucket, s3_file_key, ExtraArgs=None):
+            raise OSError("connection reset")
+
+    (tmp_path / "_images").mkdir()
+    (tmp_path / "_images" / "z.jpg").write_bytes(b"zzz")
+    (tmp_path / "a.html").write_text(PAGE_HTML)
+    pages = [md.parse_article_html(str(tmp_path / "a.html"))]
+
+    backend = image_backends.S3ImageBackend(FailingS3(), "bucket")
+    with caplog.at_level("ERROR"):
+        stats = md.upload_book_images(pages, backend)
+
+    assert stats["failed"] == 1
+    assert stats["bytes_uploaded"] == 0
+    assert not pages[0]["img_tags"][0]["src"].startswith(md.AWS_URL_PREFIX)
+    assert "connection reset" in caplog.text
+
+
+def test_s3_etag(tmp_path):
+    img_file_path = tmp_path / "z.jpg"
+    img_file_path.write_bytes(b"abcdef")
+
+    assert md.s3_etag(str(img_file_path)) == hashlib.md5(b"abcdef").hexdigest()
+    parts = hashlib.md5(b"abcd").digest() + hashlib.md5(b"ef").digest()
+    assert md.s3_etag(str(img_file_path), chunk_size=4) == (
+        hashlib.md5(parts).hexdigest() + "-2"
+    )
+
+
+def test_upload_book_images_skips_unchanged(tmp_path):
+    (tmp_path / "_images").mkdir()
+    (tmp_path / "_images" / "z.jpg").write_bytes(b"zzz")
+    (tmp_path / "a.html").write_text(PAGE_HTML)
+    pages = [md.parse_article_html(str(tmp_path / "a.html"))]
+    etag = '"%s"' % hashlib.md5(b"zzz").hexdigest()
+    s3 = RecordingS3([{"Key": "z.jpg", "Size": 3, "ETag": etag}])
+
+    backend = image_backends.S3ImageBackend(s3, "bucket")
+    stats = md.upload_book_images(pages, backend, skip_unchanged=True)
+
+    assert s3.keys == []
+    assert stats["skipped"] == 1
+    assert pages[0]["img_tags"][0]["src"] == md.AWS_URL_PREFIX + "bucket/z.jpg"
+
+
+class PagedS3:
+    """A bucket listed 2 keys per page"""
+
+    def __init__(self, keys):
+        self.objects = {key: {"ContentLength": 3, "ETag": '"etag"'} for key in keys}
+        self.prefixes = []
+        self.heads = []
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        self.prefixes.append(Prefix)
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        for start in range(0, len(keys), 2):
+            contents = [
+                {"Key": key, "Size": 3, "ETag": '"etag"'}
+                for key in keys[start : start + 2]
+            ]
+            yield {"Contents": contents, "IsTruncated": start + 2 < len(keys)}
+
+    def head_object(self, Bucket, Key):
+        self.heads.append(Key)
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return self.objects[Key]
+
+
+def test_find_s3_objects_lists_only_the_keys_of_the_book():
+    other_keys = [f"other/{n}.png" for n in range(10)]
+    s3 = PagedS3(["book/a.png", "book/b.png"] + other_keys)
+    remote_objects = md.find_s3_objects(s3, "bucket", ["book/b.png", "book/a.png"])
+    assert s3.prefixes == ["book/"]
+    assert s3.heads == []
+    assert sorted(remote_objects) == ["book/a.png", "book/b.png"]
+
+    # without a common prefix the bucket would take 6 pages, 2 HEADs do it
+    s3 = PagedS3(["a.png"] + other_keys)
+    remote_objects = md.find_s3_objects(s3, "bucket", ["a.png", "z.png"])
+    assert s3.heads == ["a.png", "z.png"]
+    assert remote_objects == {"a.png": {"size": 3, "etag": "etag"}}
+
+
+def test_content_addressed_keys_do_not_collide(tmp_path):
+    for folder, content in [("images", b"one"), ("img2", b"two")]:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "z.jpg").write_bytes(content)
+    (tmp_path / "a.html").write_text(PAGE_HTML.replace("_images/z.jpg", "images/z.jpg"))
+    (tmp_path / "b.html").write_text(PAGE_HTML.replace("_images/z.jpg", "img2/z.jpg"))
+    pages = [md.parse_article_html(str(tmp_path / f"{n}.html")) for n in "ab"]
+
+    s3 = RecordingS3()
+    backend = image_backends.S3ImageBackend(s3, "bucket", content_addressed=True)
+    md.upload_book_images(pages, backend)
+
+    assert sorted(s3.keys) == sorted(
+        "sha256/" + hashlib.sha256(content).hexdigest() + ".jpg"
+        for content in [b"one", b"two"]
+    )
+    assert s3.extra_args["CacheControl"] == md.S3_IMMUTABLE_CACHE_CONTROL
+    assert pages[0]["img_tags"][0]["src"] != pages[1]["img_tags"][0]["src"]
+
+
+class AttachmentHelpCenter:
+    """Records the attachments uploaded and associated"""
+
+    def __init__(self):
+        self.uploaded = []
+        self.associated = {}
+
+    def create_unassociated_attachment(self, data, files=None):
+        file_name, content, content_type = files["file"]
+        self.uploaded.append((file_name, content_type, data["inline"]))
+        attachment_id = len(self.uploaded)
+        return {
+            "article_attachment": {
+                "id": attachment_id,
+                "content_url": f"https://zd/hc/article_attachments/{attachment_id}",
+            }
+        }
+
+    def associate_article_attachments(self, article_id, data):
+        self.associated[article_id] = json.loads(data)["attachment_ids"]
+
+
+def test_zendesk_attachments_are_uploaded_once(tmp_path):
+    (tmp_path / "_images").mkdir()
+    (tmp_path / "_images" / "z.jpg").write_bytes(b"zzz")
+    (tmp_path / "_images" / "copy.jpg").write_bytes(b"zzz")
+    html_files_for_zendesk = []
+    for name, img in [("a", "z.jpg"), ("b", "copy.jpg")]:
+        html_file_path = str(tmp_path / f"{name}.html")
+        (tmp_path / f"{name}.html").write_text(PAGE_HTML.replace("z.jpg", img))
+        html_files_for_zendesk.append({"html_file_path": html_file_path})
+    attachments_file_path = str(tmp_path / image_backends.ZENDESK_ATTACHMENTS_FILE)
+
+    def sync(hc, article_ids=(10, 11)):
+        pages = [
+            md.parse_article_html(f["html_file_path"]) for f in html_files_for_zendesk
+        ]
+        backend = image_backends.ZendeskAttachmentImageBackend(
+            hc, attachments_file_path
+        )
+        backend.forget_missing_articles(
+            {f["article_id"] for f in html_files_for_zendesk if "article_id" in f}
+        )
+        md.upload_book_images(pages, backend, workers=2, skip_unchanged=True)
+        for article_id, f in zip(article_ids, html_files_for_zendesk):
+            f["article_id"] = article_id
+        backend.associate(html_files_for_zendesk)
+        return pages
+
+    hc = AttachmentHelpCenter()
+    pages = sync(hc)
+    assert hc.uploaded == [("z.jpg", "image/jpeg", "true")]
+    assert hc.associated == {10: [1]}
+    for page in pages:
+        assert page["img_tags"][0]["src"] == "https://zd/hc/article_attachments/1"
+
+    # known by digest, neither uploaded nor associated again
+    hc = AttachmentHelpCenter()
+    pages = sync(hc)
+    assert hc.uploaded == [] and hc.associated == {}
+    assert pages[1]["img_tags"][0]["src"] == "https://zd/hc/article_attachments/1"
+
+    # article 10 left zendesk.json and took the attachment with it
+    del html_files_for_zendesk[0]["article_id"]
+    hc = AttachmentHelpCenter()
+    pages = sync(hc, article_ids=(12, 11))
+    assert hc.uploaded == [("z.jpg", "image/jpeg", "true")]
+    assert hc.associated == {12: [1]}
+
+
+class RemoteHelpCenter:
+    """Category 7, records what was listed"""
+
+    def __init__(self, articles):
+        self.articles = articles
+        self.calls = []
+
+    def iter_articles_by_category(self, category_id):
+        self.calls.append(("category", category_id))
+        return iter(self.articles)
+
+
+def test_list_remote_articles_drops_the_bodies():
+    hc = RemoteHelpCenter(
+        [
+            {"id": 10, "title": "A", "section_id": 1, "body": "<p>a</p>"},
+            {"id": 11, "title": "B", "section_id": 2, "body": "<p>b</p>"},
+        ]
+    )
+
+    remote = md.list_remote_articles(hc, 7)
+    assert hc.calls == [("category", 7)]
+    assert [article["title"] for article in remote["articles"]] == ["A", "B"]
+    assert "body" not in remote["articles"][0]
+    articles_by_title = md.index_articles_by_title(remote)
+    assert md.article_exists(articles_by_title, "B", 2)["id"] == 11
+
+
+class SectionsHelpCenter:
+    """Category 7 with section A, records the section calls"""
+
+    def __init__(self):
+        self.calls = []
+        self.ids = iter(range(100, 200))
+
+    def iter_sections_by_category(self, category_id):
+        self.calls.append(("list", category_id))
+        return iter([{"id": 1, "name": "A", "category_id": 7}])
+
+    def create_section(self, category_id, data, locale=None):
+        section = dict(json.loads(data)["section"], id=next(self.ids))
+        self.calls.append(("create", section["name"]))
+        return {"section": section}
+
+
+def test_handle_sections_creates_missing_sections_once(tmp_path):
+    html_files_list = [
+        {"toc_file": name, "section_name": section, "html_file_path": name}
+        for name, section in [("a", "A"), ("b", "B"), ("c", "B"), ("d", "C")]
+    ]
+    hc = SectionsHelpCenter()
+    html_files = md.handle_sections_on_zendesk(hc, html_files_list, 7, workers=2)
+    assert hc.calls[0] == ("list", 7)
+    assert sorted(hc.calls[1:]) == [("create", "B"), ("create", "C")]
+    assert html_files[1]["section_id"] == html_files[2]["section_id"]
+    assert len({f["section_id"] for f in html_files}) == 3
+
+    zendesk_file_path = str(tmp_path / md.ZENDESK_FILE)
+    md.write_zendesk_json(zendesk_file_path, html_files, "Book", 7)
+    zendesk_json = md.read_zendesk_json(zendesk_file_path)
+    assert md.manifest_category_id(zendesk_json, "Book") == 7
+    assert md.manifest_category_id(zendesk_json, "Other") is None
+    assert md.manifest_sections(zendesk_json, 8) == {}
+
+    hc = SectionsHelpCenter()
+    known_sections = md.manifest_sections(zendesk_json, 7)
+    assert md.handle_sections_on_zendesk(
+        hc, html_files_list, 7, known_sections
+    ) == html_files
+    assert hc.calls == []
+
+
+class ArchiveHelpCenter:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.archived = []
+
+    def archive_article(self, article_id, locale=None):
+        # what Base.delete returns: the status of a 204 or 404, else the body
+        if article_id == 3 and article_id in self.fail:
+            return {"error": "InvalidRecord"}
+        if article_id in self.fail:
+            return None
+        self.archived.append(article_id)
+        return {"status_code": 204}
+
+
+def test_archive_resumes_from_checkpoint(tmp_path):
+    zendesk_file_path = str(tmp_path / md.ZENDESK_FILE)
+    checkpoint_file_path = str(tmp_path / md.ZENDESK_ARCHIVE_FILE)
+    md.write_zendesk_json(
+        zendesk_file_path,
+        [{"toc_file": f"p{n}", "article_id": n} for n in range(1, 11)]
+        + [{"toc_file": "not_synced"}],
+    )
+    zendesk_json = md.read_zendesk_json(zendesk_file_path)
+
+    hc = ArchiveHelpCenter(fail={3, 7})
+    assert not md.archive_book_from_zendesk(
+        hc, zendesk_json, zendesk_file_path, 4, checkpoint_file_path
+    )
+    assert sorted(hc.archived) == [1, 2, 4, 5, 6, 8, 9, 10]
+    assert md.read_archive_checkpoint(checkpoint_file_path) == set(hc.archived)
+    assert md.read_zendesk_json(zendesk_file_path)["files"]
+
+    hc = ArchiveHelpCenter()
+    assert md.archive_book_from_zendesk(
+        hc, zendesk_json, zendesk_file_path, 4, checkpoint_file_path
+    )
+    assert sorted(hc.archived) == [3, 7]
+    assert md.read_zendesk_json(zendesk_file_path)["files"] == {}
+    assert not (tmp_path / md.ZENDESK_ARCHIVE_FILE).exists()
+
+
+def test_find_matching_url_uses_the_full_relative_path():
+    article_urls = md.index_article_urls(
+        [
+            {"html_file_path": "/book/intro/setup.html", "article_html_url": "zd/1"},
+            {"html_file_path": "/book/advanced/setup.html", "article_html_url": "zd/2"},
+            {"html_file_path": "/book/advanced/b.html", "article_html_url": "zd/3"},
+        ]
+    )
+    assert md.find_matching_url("advanced/setup.html", article_urls) == "zd/2"
+    assert md.find_matching_url("setup.html#install", article_urls) == "zd/1#install"
+    assert md.find_matching_url("missing.html", article_urls) == "#"
+
+
+def test_articles_not_created_yet_get_placeholder_urls(page_path):
+    html_files_for_zendesk = [
+        {"toc_file": "a", "html_file_path": page_path, "article_html_url": "zd/a"},
+        {"toc_file": "b", "html_file_path": "/book/_build/html/b.html"},
+    ]
+    article_urls = md.index_article_urls(html_files_for_zendesk)
+    assert md.find_matching_url("b.html#part", article_urls) == (
+        md.placeholder_url("b") + "#part"
+    )
+    page = md.parse_article_html(page_path)
+    assert md.has_placeholder_links(md.update_urls_in_article_dict(page, article_urls))
+
+    html_files_for_zendesk[1]["article_html_url"] = "zd/b"
+    article_urls = md.index_article_urls(html_files_for_zendesk)
+    article_dict = md.update_urls_in_article_dict(page, article_urls)
+    assert not md.has_placeholder_links(article_dict)
+
+
+@pytest.fixture
+def book_path(tmp_path):
+    (tmp_path / "_config.yml").write_text("title: Book\n")
+    (tmp_path / "_toc.yml").write_text(
+        "format: jb-book\nroot: intro\nparts:\n"
+        "  - caption: Part\n    chapters:\n      - file: a\n      - file: b\n"
+    )
+    (tmp_path / "intro.md").write_text("# Intro\n")
+    (tmp_path / "a.md").write_text("# A\n![fig](fig.png)\n")
+    (tmp_path / "b.ipynb").write_text("{}")
+    (tmp_path / "fig.png").write_bytes(b"png")
+    return tmp_path
+
+
+def test_source_fingerprints_follow_pages_and_their_images(book_path):
+    before = md.source_fingerprints(str(book_path))
+    (book_path / "fig.png").write_bytes(b"other png")
+    after = md.source_fingerprints(str(book_path))
+
+    assert before["book"] == after["book"]
+    assert before["files"]["a"] != after["files"]["a"]
+    assert before["files"]["b"] == after["files"]["b"]
+
+    (book_path / "_config.yml").write_text("title: Renamed\n")
+    assert md.source_fingerprints(str(book_path))["book"] != after["book"]
+
+
+def test_incremental_build_skips_unchanged_sources(book_path, monkeypatch):
+    builds = []
+
+    def fake_run(cmd_string, shell, cwd):
+        builds.append(cmd_string)
+        return type("Result", (), {"returncode": 0})
+
+    monkeypatch.setattr(md.subprocess, "run", fake_run)
+    md.gen_jupyter_book(str(book_path), incremental=True)
+    md.gen_jupyter_book(str(book_path), incremental=True)
+    assert len(builds) == 1
+
+    (book_path / "b.ipynb").write_text('{"cells": []}')
+    md.gen_jupyter_book(str(book_path), incremental=True)
+    assert len(builds) == 2
+
+
+def test_build_timings_split_notebook_execution_from_reading(monkeypatch):
+    from jupyterbook_to_zendesk.commands import build_timings
+
+    clock = iter([1.0, 3.0, 11.0, 14.0])
+    monkeypatch.setattr(build_timings.time, "perf_counter", lambda: next(clock))
+    env = type("Env", (), {})()
+    env.nb_execution_data = {
+        "nb": {"runtime": 4.0, "method": "auto"},
+        "cached": {"runtime": 50.0, "method": "cache"},
+        "old": {"runtime": 100.0, "method": "auto"},
+    }
+    app = type("App", (), {"env": env})()
+
+    build_timings.reset()
+    # jupyter-cache runs the outdated notebooks between these two
+    build_timings.on_env_get_outdated_start(app, env, set(), set(), set())
+    build_timings.on_env_get_outdated_end(app, env, set(), set(), set())
+    build_timings.on_env_before_read_docs(app, env, ["nb", "cached", "page"])
+    build_timings.on_env_updated(app, env)
+    build_timings.on_build_finished(app, None)
+
+    assert build_timings.timings == {
+        "read": 4.0,
+        "execute": 6.0,
+        "write": 3.0,
+        "documents": 3,
+    }
+
+
+def test_build_timings_read_myst_nb_1_execution_data(monkeypatch):
+    from jupyterbook_to_zendesk.commands import build_timings
+
+    clock = iter([1.0, 1.0, 11.0, 14.0])
+    monkeypatch.setattr(build_timings.time, "perf_counter", lambda: next(clock))
+    monkeypatch.setattr(build_timings.time, "time", lambda: 1000.0)
+    env = type("Env", (), {})()
+    env.nb_metadata = {
+        "nb": {"exec_data": {"runtime": 3.0, "mtime": 1005.0, "method": "cache"}},
+        # a cache hit, executed by an earlier build
+        "cached": {"exec_data": {"runtime": 50.0, "mtime": 10.0, "method": "cache"}},
+    }
+    app = type("App", (), {"env": env})()
+
+    build_timings.reset()
+    build_timings.on_env_get_outdated_start(app, env, set(), set(), set())
+    build_timings.on_env_get_outdated_end(app, env, set(), set(), set())
+    build_timings.on_env_before_read_docs(app, env, ["nb", "cached", "page"])
+    build_timings.on_env_updated(app, env)
+    build_timings.on_build_finished(app, None)
+    assert build_timings.timings["execute"] == 3.0
+    assert build_timings.timings["read"] == 7.0
+
+    # without any execution data there is no telling reading and executing apart
+    clock = iter([1.0, 1.0, 11.0, 14.0])
+    app.env = type("Env", (), {})()
+    build_timings.reset()
+    build_timings.on_env_get_outdated_start(app, app.env, set(), set(), set())
+    build_timings.on_env_get_outdated_end(app, app.env, set(), set(), set())
+    build_timings.on_env_before_read_docs(app, app.env, ["nb"])
+    build_timings.on_env_updated(app, app.env)
+    build_timings.on_build_finished(app, None)
+    assert build_timings.timings["execute"] is None
+    assert build_timings.timings["read"] == 10.0
+
+
+def test_execution_config(tmp_path):
+    assert md.execution_config() == {}
+    execution = md.execution_config(cache=str(tmp_path / "cache"), timeout=120)
+    assert execution == {
+        "execute_notebooks": "cache",
+        "cache": str(tmp_path / "cache"),
+        "timeout": 120,
+    }
+
+    (tmp_path / "_config.yml").write_text("title: Book\nexecute:\n  timeout: 30\n")
+    config_file_path = md.write_execution_config(str(tmp_path), {"timeout": 120})
+    with open(config_file_path) as f:
+        config = md.yaml.safe_load(f)
+    assert config == {"title": "Book", "execute": {"timeout": 120}}
+
+
+def test_in_process_build_passes_execute_options_as_user_config(
+    tmp_path, monkeypatch
+):
+    (tmp_path / "_config.yml").write_text("title: Book\n")
+    (tmp_path / "_toc.yml").write_text("format: jb-book\nroot: intro\n")
+    user_configs = []
+
+    def get_final_config(user_yaml=None, cli_config=None, sourcedir=None):
+        with open(user_yaml) as f:
+            user_configs.append(md.yaml.safe_load(f))
+        return {"extensions": ["myst_nb"]}, {}
+
+    def build_sphinx(sourcedir, outputdir, path_config=None, **kwargs):
+        get_final_config(user_yaml=path_config)
+        assert "jupyter_execute_notebooks" not in kwargs["confoverrides"]
+        return 0
+
+    jupyter_book = types.ModuleType("jupyter_book")
+    config = types.ModuleType("jupyter_book.config")
+    config.get_final_config = get_final_config
+    sphinx = types.ModuleType("jupyter_book.sphinx")
+    sphinx.build_sphinx = build_sphinx
+    monkeypatch.setitem(sys.modules, "jupyter_book", jupyter_book)
+    monkeypatch.setitem(sys.modules, "jupyter_book.config", config)
+    monkeypatch.setitem(sys.modules, "jupyter_book.sphinx", sphinx)
+
+    md.build_jupyter_book_in_process(str(tmp_path), execution={"timeout": 120})
+    # jupyter-book itself reads the execute section, for the sphinx config and
+    # again in build_sphinx
+    assert user_configs == [{"title": "Book", "execute": {"timeout": 120}}] * 2
+    assert not (tmp_path / md.EXECUTION_CONFIG_FILE).exists()
+
+
+def test_parse_build_jobs():
+    assert md.parse_build_jobs(None) is None
+    assert md.parse_build_jobs("3") == 3
+    assert md.parse_build_jobs("auto") >= 1
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""Tests for the `jupyterbook_to_zendesk.zendeskhc` client."""
+import json
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+import urllib3
+
+from jupyterbook_to_zendesk.zendeskhc.HelpCenter import HelpCenter
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import RateLimitBudget
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import RetryStats
+from jupyterbook_to_zendesk.zendeskhc.ZendeskBase import parse_retry_after
+
+
+def make_response(status_code, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    if body is not None:
+        response.headers["Content-Type"] = "application/json; charset=UTF-8"
+        response._content = json.dumps(body).encode("utf-8")
+    else:
+        response._content = b""
+    return response
+
+
+class FakeSession:
+    """Hands out the queued responses, exceptions are raised"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("time.monotonic", clock.monotonic)
+    monkeypatch.setattr("time.sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def hc(clock):
+    hc = HelpCenter("https://example.zendesk.com", "user", "token")
+    hc.retry_stats = RetryStats()
+    hc.rate_limit = RateLimitBudget()
+    hc.backoff_base = 0.001
+    return hc
+
+
+def test_retry_after_header_is_honored(hc, clock):
+    start = clock.now
+    hc.session = FakeSession(
+        [
+            make_response(429, headers={"Retry-After": "7"}),
+            make_response(200, {"user": {"id": 1}}),
+        ]
+    )
+    assert hc.get_me() == {"user": {"id": 1}}
+    assert hc.retry_stats.retries == 1
+    assert clock.now - start == pytest.approx(7.0)
+    assert hc.retry_stats.sleep_seconds == pytest.approx(7.0)
+
+
+def test_server_errors_and_connection_errors_are_retried(hc):
+    hc.session = FakeSession(
+        [
+            make_response(503),
+            requests.ConnectionError("reset"),
+            make_response(200, {"article": {"id": 2}}),
+        ]
+    )
+    assert hc.update_article_metadata(2, "{}") == {"article": {"id": 2}}
+    assert hc.retry_stats.retries == 2
+    method, url, kwargs = hc.session.requests[-1]
+    assert method == "PUT"
+    assert kwargs["headers"]["Content-Type"] == "application/json"
+    assert kwargs["timeout"] == hc.timeout
+
+
+def test_posts_are_not_sent_twice(hc):
+    # zendesk may have created the article before failing
+    hc.session = FakeSession([make_response(502)])
+    assert hc.create_article(1, "{}") is None
+    hc.session = FakeSession([requests.ConnectionError("Connection aborted.")])
+    with pytest.raises(requests.ConnectionError):
+        hc.create_article(1, "{}")
+    assert hc.retry_stats.retries == 0
+
+    # a connection that could not be opened sent nothing
+    refused = urllib3.exceptions.NewConnectionError(None, "refused")
+    hc.session = FakeSession(
+        [
+            requests.ConnectionError(
+                urllib3.exceptions.MaxRetryError(None, "/", refused)
+            ),
+            make_response(201, {"article": {"id": 2}}),
+        ]
+    )
+    assert hc.create_article(1, "{}") == {"article": {"id": 2}}
+    assert hc.retry_stats.retries == 1
+
+
+def test_attachments_are_sent_as_multipart_forms(hc):
+    hc.session = FakeSession(
+        [
+            make_response(429, headers={"Retry-After": "1"}),
+            make_response(201, {"article_attachment": {"id": 3}}),
+        ]
+    )
+    files = {"file": ("z.png", b"png", "image/png")}
+    response_json = hc.create_unassociated_attachment({"inline": "true"}, files=files)
+    assert response_json == {"article_attachment": {"id": 3}}
+    method, url, kwargs = hc.session.requests[-1]
+    assert url.endswith("/api/v2/help_center/articles/attachments.json")
+    assert kwargs["files"] == files
+    assert kwargs["data"] == {"inline": "true"}
+    # requests sets the multipart content type with its boundary
+    assert "Content-Type" not in kwargs["headers"]
+
+
+def test_retries_are_capped(hc):
+    hc.max_retries = 2
+    hc.session = FakeSession([requests.ConnectionError("down")] * 3)
+    with pytest.raises(requests.ConnectionError):
+        hc.get_me()
+    assert hc.retry_stats.retries == 2
+
+
+def test_retries_stop_at_the_deadline(hc):
+    hc.max_retry_seconds = 10
+    hc.session = FakeSession([make_response(429, headers={"Retry-After": "60"})])
+    assert hc.get_me() is None
+    assert hc.retry_stats.retries == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("12") == 12
+    assert parse_retry_after(None) == 1.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") == 1.0
+
+
+def test_rate_limit_budget_spaces_requests(clock):
+    budget = RateLimitBudget(requests_per_minute=120)
+    start = clock.now
+    for _ in range(10):
+        budget.wait()
+    # 2 requests a second, the first 2 are the initial burst
+    assert clock.now - start == pytest.approx(4.0)
+
+
+def test_rate_limit_budget_follows_zendesk_headers(clock):
+    budget = RateLimitBudget(requests_per_minute=700)
+    budget.update({"X-Rate-Limit": "60", "X-Rate-Limit-Remaining": "0"})
+    assert budget.requests_per_minute == 60
+
+    start = clock.now
+    budget.wait()
+    assert clock.now - start == pytest.approx(1.0)
+
+
+def test_rate_limit_budget_is_unlimited_until_configured(clock):
+    budget = RateLimitBudget()
+    start = clock.now
+    for _ in range(100):
+        budget.wait()
+    assert clock.now == start
+
+
+def test_pages_are_streamed_one_at_a_time(hc):
+    base = "https://example.zendesk.com/api/v2/help_center/articles.json"
+    hc.session = FakeSession(
+        [
+            make_response(200, {"articles": [{"id": 1}], "next_page": base + "?p=2"}),
+            make_response(200, {"articles": [{"id": 2}], "next_page": None}),
+        ]
+    )
+    articles = hc.iter_all_articles()
+    assert hc.session.requests == []
+    first = next(iter(articles))
+    assert first == {"id": 1}
+    assert len(hc.session.requests) == 1
+
+    hc.session.responses = [
+        make_response(200, {"articles": [{"id": 1}], "next_page": base + "?p=2"}),
+        make_response(200, {"articles": [{"id": 2}], "next_page": None}),
+    ]
+    data = hc.list_all_articles()
+    assert [article["id"] for article in data["articles"]] == [1, 2]
+    assert data["next_page"] is None
+
+
+def test_cursor_pagination_is_the_default(hc):
+    def cursor_page(ids, next_url):
+        return make_response(
+            200,
+            {
+                "sections": [{"id": i} for i in ids],
+                "meta": {"has_more": next_url is not None, "after_cursor": "x"},
+                "links": {"next": next_url},
+            },
+        )
+
+    next_url = "https://example.zendesk.com/api/v2/help_center/sections.json?next"
+    hc.session = FakeSession([cursor_page([1, 2], next_url), cursor_page([3], None)])
+    data = hc.list_all_sections()
+
+    assert "page[size]=100" in hc.session.requests[0][1]
+    assert hc.session.requests[1][1] == next_url
+    assert [section["id"] for section in data["sections"]] == [1, 2, 3]
+    assert data["meta"]["has_more"] is False
+
+    hc.session = FakeSession([make_response(200, {"sections": [], "next_page": None})])
+    hc.list_all_sections({"page": 1})
+    assert "per_page=100" in hc.session.requests[0][1]
+    assert "page[size]" not in hc.session.requests[0][1]
+
+
+def test_offset_pages_can_be_prefetched(hc):
+    base = "https://example.zendesk.com/api/v2/help_center/articles.json"
+    responses = {
+        page: make_response(
+            200,
+            {
+                "articles": [{"id": page}],
+                "page": page,
+                "page_count": 4,
+                "next_page": f"{base}?page={page + 1}&per_page=100"
+                if page < 4
+                else None,
+            },
+        )
+        for page in range(1, 5)
+    }
+
+    class PagedSession(FakeSession):
+        def request(self, method, url, **kwargs):
+            self.requests.append((method, url, kwargs))
+            return responses[int(dict(parse_qsl(urlsplit(url).query)).get("page", 1))]
+
+    hc.session = PagedSession([])
+    hc.page_prefetch_workers = 3
+    data = hc.list_all_articles()
+
+    assert "per_page=100" in hc.session.requests[0][1]
+    assert sorted(url for _, url, _ in hc.session.requests[1:]) == [
+        f"{base}?page={page}&per_page=100" for page in (2, 3, 4)
+    ]
+    assert [article["id"] for article in data["articles"]] == [1, 2, 3, 4]
+    assert data["next_page"] is None